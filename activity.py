@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import bindparam, update
+from database import run_db
+from models import User
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def write_activity(db, entries):
+    # Plain executemany UPDATEs; users deleted in the meantime just match
+    # no row.
+    users = User.__table__
+    touched = []
+    versioned = []
+    for user_uuid, (last_used, version) in entries.items():
+        row = {"b_uuid": user_uuid, "b_last_used": last_used, "b_version": version}
+        (versioned if version else touched).append(row)
+    statement = update(users).where(users.c.uuid == bindparam("b_uuid"))
+    if touched:
+        db.execute(statement.values(last_used=bindparam("b_last_used")), touched)
+    if versioned:
+        db.execute(statement.values(last_used=bindparam("b_last_used"),
+                                    version=bindparam("b_version")), versioned)
+    db.commit()
+
+
+class ActivityBuffer:
+    # Write-behind for the last_used/version touch done by /api/motd. Updates
+    # are coalesced per user in memory and written in one transaction every
+    # `interval` seconds and at shutdown, instead of one commit per request.
+    # Entries stay readable through get() until their flush has committed.
+    def __init__(self, interval: float = 10):
+        self.interval = interval
+        self.pending = {}
+        self.inflight = {}
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        # Called with each user uuid once its update is committed.
+        self.on_flush = None
+        self._stop = asyncio.Event()
+        self._task = None
+
+    def record(self, user_uuid: str, version: str = None):
+        if version is None:
+            previous = self.get(user_uuid)
+            if previous:
+                version = previous[1]
+        self.pending[user_uuid] = (datetime.utcnow(), version)
+
+    def get(self, user_uuid: str):
+        return self.pending.get(user_uuid) or self.inflight.get(user_uuid)
+
+    async def flush(self):
+        if not self.pending or self.inflight:
+            return
+        self.inflight, self.pending = self.pending, {}
+        try:
+            await run_db(write_activity, self.inflight)
+        except Exception:
+            self.failures += 1
+            logger.exception("Failed to write %d activity updates", len(self.inflight))
+            for user_uuid, entry in self.inflight.items():
+                self.pending.setdefault(user_uuid, entry)
+            return
+        finally:
+            flushed, self.inflight = self.inflight, {}
+        self.flushes += 1
+        self.written += len(flushed)
+        if self.on_flush:
+            for user_uuid in flushed:
+                self.on_flush(user_uuid)
+
+    def start(self):
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "flushes": self.flushes,
+            "written": self.written,
+            "failures": self.failures,
+        }
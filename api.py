@@ -1,31 +1,37 @@
-from fastapi import APIRouter, Response, Request, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, Response, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from starlette.requests import ClientDisconnect
 import secrets
-import uuid as uuidlib
-import httpx
 import hashlib
 import json
 import os
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import PendingVerification, User, Token, Avatar, Subscription
-import random
+from database import engine, run_db
+from models import PendingVerification, User, Token, Avatar
+from subscriptions import subscriptions
+from auth_cache import AuthCache, UserSnapshot
+from profile_cache import ProfileCache
+from activity import ActivityBuffer
+from events import EventDebouncer
+from motd import MotdProvider
+from mojang import SessionServerUnavailable, create_verifier
+from maintenance import create_maintenance
+from profiling import LoopMonitor, MemoryTracer, StackSampler
+import metrics
+from blobstore import BlobStore
+from asset_cache import AssetCache
+from httputil import etag_matches
+from connections import ClientSession, Connection, Kind, queue_metrics, queue_stats
+from backplane import create_backplane
+from ratelimit import RateLimiter
+from codec import C2S, S2C
+import badges
 from datetime import datetime
-import struct
-import time
-from collections import defaultdict
 
 
 router = APIRouter()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 active_connections = {}
 
 
@@ -34,179 +40,191 @@ with open(CONFIG_PATH, "r", encoding="utf-8") as f:
     CONFIG = json.load(f)
 
 
+def auth_cache_settings():
+    settings = CONFIG.get("authCache", {})
+    return settings.get("ttl", 60), settings.get("maxSize", 10000)
+
+
+def profile_cache_settings():
+    settings = CONFIG.get("profileCache", {})
+    return settings.get("ttl", 300), settings.get("maxSize", 10000)
+
+
+auth_cache = AuthCache(*auth_cache_settings())
+profile_cache = ProfileCache(*profile_cache_settings())
+blob_store = BlobStore(CONFIG.get("avatarsDir", "avatars"))
+rate_limiter = RateLimiter(CONFIG.get("rateLimitIdleSeconds", 300))
+backplane = create_backplane(CONFIG.get("backplane", {}))
+verifier = create_verifier(CONFIG.get("mojang", {}))
+maintenance = create_maintenance(CONFIG.get("maintenance", {}))
+activity = ActivityBuffer(CONFIG.get("activityFlushSeconds", 10))
+avatar_events = EventDebouncer(CONFIG.get("eventDebounceSeconds", 1))
+
+
+def motd_settings():
+    return (CONFIG.get("motds", []), CONFIG.get("motdsDir", "motds"),
+            CONFIG.get("motdCheckSeconds", 5))
+
+
+motd = MotdProvider(*motd_settings())
+motd.refresh()
+asset_cache = AssetCache(os.path.join(CONFIG.get("assetsDir", "assets"), "Assets-main"),
+                         CONFIG.get("assetCacheBytes", 32 * 1024 * 1024))
+
+
 @router.get("/")
 async def root():
     return {"message": "Hiii :3"}
 
 
 @router.get("/api")
-async def check_token_validity(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
+async def check_token_validity(request: Request):
+    token = request_token(request)
     if not token:
         return Response(content="Missing token", status_code=401)
-    user = get_user_by_token(token, db)
+    user = await get_user_by_token(token)
     if not user:
         return Response(content="Invalid token", status_code=401)
     return Response(content="Valid token", status_code=200)
 
 
 @router.get("/api/auth/id")
-async def get_auth_id(username: str, db: Session = Depends(get_db)):
-    existing = db.query(PendingVerification).filter_by(
-        username=username).first()
-    if existing:
-        return Response(content=existing.id, media_type="text/plain")
-    auth_id = secrets.token_hex(16)
-    db.add(PendingVerification(id=auth_id, username=username))
-    db.commit()
+async def get_auth_id(username: str):
+    def get_or_create(db):
+        existing = db.query(PendingVerification).filter_by(
+            username=username).first()
+        if existing:
+            existing.created_at = datetime.utcnow()
+            db.commit()
+            return existing.id
+        auth_id = secrets.token_hex(16)
+        db.add(PendingVerification(id=auth_id, username=username))
+        db.commit()
+        return auth_id
+    auth_id = await run_db(get_or_create)
     return Response(content=auth_id, media_type="text/plain")
 
 
 @router.get("/api/auth/verify")
-async def verify(id: str, db: Session = Depends(get_db)):
+async def verify(id: str):
     token_str = secrets.token_urlsafe(16)
-    pv = db.query(PendingVerification).filter_by(id=id).first()
-    if not pv:
-        return Response(content="Invalid ID", status_code=400)
-    user = db.query(User).filter_by(username=pv.username).first()
-    if user:
-        old_token = db.query(Token).filter_by(user_uuid=user.uuid).first()
-        if old_token:
-            db.delete(old_token)
+
+    def rotate_token(db):
+        pv = db.query(PendingVerification).filter_by(id=id).first()
+        if not pv:
+            return None, None
+        user = db.query(User).filter_by(username=pv.username).first()
+        if not user:
+            return pv.username, None
+        old_tokens = db.query(Token).filter_by(user_uuid=user.uuid)
+        old_token_strs = [token.token for token in old_tokens]
+        old_tokens.delete(synchronize_session=False)
         new_token = Token(token=token_str, user_uuid=user.uuid)
         db.add(new_token)
         db.delete(pv)
         db.commit()
-        return Response(content=token_str, media_type="text/plain")
-    auth_url = f"https://sessionserver.mojang.com/session/minecraft/hasJoined?username={pv.username}&serverId={id}"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(auth_url)
-        if response.status_code != 200:
-            return Response(content="Verification failed with Mojang", status_code=403)
-    user_uuid = str(uuidlib.UUID(response.json().get("id")))
-    user = User(uuid=user_uuid, username=pv.username)
-    db.add(user)
-    db.flush()
-    db.add(Token(token=token_str, user_uuid=user.uuid))
-    db.delete(pv)
-    db.commit()
-    return Response(content=token_str, media_type="text/plain")
-
-
-def get_user_by_token(token: str, db: Session):
-    token_obj = db.query(Token).filter_by(token=token).first()
-    if not token_obj:
-        return None
-    return db.query(User).filter_by(uuid=token_obj.user_uuid).first()
+        return pv.username, old_token_strs
 
+    username, old_token_strs = await run_db(rotate_token)
+    if not username:
+        return Response(content="Invalid ID", status_code=400)
+    if old_token_strs is not None:
+        for old_token_str in old_token_strs:
+            backplane.publish_invalidate(old_token_str)
+        return Response(content=token_str, media_type="text/plain")
+    try:
+        user_uuid = await verifier.verify(username, id)
+    except SessionServerUnavailable:
+        return Response(content="Mojang session server unavailable", status_code=503)
+    if not user_uuid:
+        return Response(content="Verification failed with Mojang", status_code=403)
+
+    def create_user(db):
+        # Claim the pending id first so a concurrent verify of the same id
+        # that lost the race finds nothing to create.
+        if not db.query(PendingVerification).filter_by(id=id).delete():
+            return False
+        user = User(uuid=user_uuid, username=username)
+        db.add(user)
+        db.flush()
+        db.add(Token(token=token_str, user_uuid=user.uuid))
+        db.commit()
+        return True
 
-class S2C:
-    AUTH = 0
-    PING = 1
-    EVENT = 2
-    TOAST = 3
-    CHAT = 4
-    NOTICE = 5
+    if not await run_db(create_user):
+        return Response(content="Invalid ID", status_code=400)
+    return Response(content=token_str, media_type="text/plain")
 
-    class NoticeType:
-        SIZE = 0
-        RATE = 1
 
-    class ToastType:
-        DEFAULT = 0
-        WARNING = 1
-        ERROR = 2
-        CHEESE = 3
+def load_user_by_token(db, token: str):
+    user = db.query(User).join(Token, Token.user_uuid == User.uuid).filter(
+        Token.token == token).first()
+    return UserSnapshot.from_user(user) if user else None
 
-    @staticmethod
-    def auth():
-        return bytes([S2C.AUTH])
 
-    @staticmethod
-    def ping(target_uuid: str, ping_id: int, sync: bool, data: bytes):
-        uuid_bytes = uuidlib.UUID(target_uuid).bytes
-        msb = int.from_bytes(uuid_bytes[:8], "big", signed=False)
-        lsb = int.from_bytes(uuid_bytes[8:], "big", signed=False)
-        return struct.pack(">bQQib", S2C.PING, msb, lsb, ping_id, int(sync)) + data
+async def get_user_by_token(token: str):
+    if not token:
+        return None
+    snapshot = auth_cache.get(token)
+    if snapshot:
+        return snapshot
+    snapshot = await run_db(load_user_by_token, token)
+    if snapshot:
+        auth_cache.put(token, snapshot)
+    return snapshot
 
-    @staticmethod
-    def event(uuid: str):
-        uuid_bytes = uuidlib.UUID(uuid).bytes
-        msb = int.from_bytes(uuid_bytes[:8], "big", signed=False)
-        lsb = int.from_bytes(uuid_bytes[8:], "big", signed=False)
-        return struct.pack(">bQQ", S2C.EVENT, msb, lsb)
 
-    @staticmethod
-    def toast(type: int, title: str, message: str = ""):
-        title_bytes = title.encode("utf-8")
-        message_bytes = message.encode("utf-8")
-        return struct.pack(">bb", S2C.TOAST, type) + title_bytes + b"\0" + message_bytes
+def request_token(request: Request):
+    # TokenMiddleware has already pulled the header out into the scope.
+    if "token" in request.scope:
+        return request.scope["token"]
+    return request.headers.get("token")
 
-    @staticmethod
-    def chat(message: str):
-        message_bytes = message.encode("utf-8")
-        return bytes([S2C.CHAT]) + message_bytes
 
-    @staticmethod
-    def notice(type: int):
-        return bytes([S2C.NOTICE, type])
+async def request_user(request: Request):
+    return await get_user_by_token(request_token(request))
 
 
 @router.get("/api/assets/v2")
-async def list_assets():
-    assets_path = f"./{CONFIG.get('assetsDir', 'assets')}/Assets-main/"
-    with open(os.path.join(assets_path, "v2.json"), "r", encoding="utf-8") as f:
-        assets_index = json.load(f)
-    return assets_index
+async def list_assets(request: Request):
+    if asset_cache.index is None:
+        try:
+            await run_in_threadpool(asset_cache.ensure_loaded)
+        except OSError:
+            return Response(content="Assets unavailable", status_code=503)
+    return asset_cache.index_response(request)
 
 
 @router.get("/api/assets/v2/{asset_path:path}")
-async def get_asset(asset_path: str):
-    local_asset_path = f"./{CONFIG.get('assetsDir', 'assets')}/Assets-main/v2/{asset_path}"
-    if os.path.exists(local_asset_path):
-        with open(local_asset_path, "rb") as asset_file:
-            asset_data = asset_file.read()
-        return Response(content=asset_data, media_type="application/octet-stream")
-    else:
-        return Response(content="Asset not found", status_code=404)
+async def get_asset(request: Request, asset_path: str):
+    if asset_cache.index is None:
+        try:
+            await run_in_threadpool(asset_cache.ensure_loaded)
+        except OSError:
+            return Response(content="Asset not found", status_code=404)
+    return metrics.record_served("asset", await asset_cache.serve(request, asset_path))
 
 
 @router.get("/api/motd")
-async def get_motd(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db) if token else None
+async def get_motd(request: Request):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
-    user.last_used = datetime.utcnow()
     user_agent = request.headers.get("user-agent", "")
     version = None
     parts = user_agent.split("/")
     if len(parts) > 1:
         version = parts[1].strip()
-    if version:
-        user.version = version
-    db.commit()
-
-    motds = CONFIG.get("motds", []).copy()
 
-    motds_folder = CONFIG.get("motdsDir", "motds")
-    if os.path.exists(motds_folder) and os.path.isdir(motds_folder):
-        for filename in os.listdir(motds_folder):
-            file_path = os.path.join(motds_folder, filename)
-            if os.path.isfile(file_path):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    motds.append(f.read().strip())
+    activity.record(user.uuid, version)
+    LocalDelivery.profile(user.uuid)
 
-    if not motds:
-        motds = ["No MOTDs configured"]
-
-    return Response(content=random.choice(motds), media_type="text/plain")
+    return Response(content=motd.choice(), media_type="text/plain")
 
 
 @router.get("/api/version")
-async def get_version(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db) if token else None
+async def get_version(request: Request):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
     return CONFIG.get("figuraVersions", {
@@ -216,9 +234,8 @@ async def get_version(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/api/limits")
-async def get_limits(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db) if token else None
+async def get_limits(request: Request):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
     return {
@@ -233,166 +250,328 @@ async def get_limits(request: Request, db: Session = Depends(get_db)):
             "maxAvatarSize": user.max_avatar_size,
             "maxAvatars": user.max_avatars,
             "allowedBadges": {
-                "special": [int(x) for x in user.special_badges.split(",")],
-                "pride": [int(x) for x in user.pride_badges.split(",")]
+                "special": badges.special(user.special_badges_mask),
+                "pride": badges.pride(user.pride_badges_mask)
             }
         }
     }
 
 
+class LocalDelivery:
+    # Fan-out to the connections held by this process. The backplane calls
+    # these for messages published here and for ones from other workers.
+    @staticmethod
+    def ping(target_uuid: str, packet: bytes, sync: bool):
+        kind = Kind.SYNC_PING if sync else Kind.PING
+        delivered = 0
+        for sub_uuid in subscriptions.subscribers(target_uuid):
+            if target_uuid == sub_uuid and not sync:
+                continue
+            conn = active_connections.get(sub_uuid)
+            if conn:
+                conn.send(packet, kind)
+                delivered += 1
+        metrics.ws_fanout.observe(delivered)
+
+    @staticmethod
+    def event(target_uuid: str):
+        event_packet = S2C.event(target_uuid)
+        for sub_uuid in subscriptions.subscribers(target_uuid):
+            if sub_uuid == target_uuid:
+                continue
+            conn = active_connections.get(sub_uuid)
+            if conn:
+                conn.send(event_packet, Kind.EVENT, target_uuid)
+        profile_cache.invalidate(target_uuid)
+
+    @staticmethod
+    def broadcast(packet: bytes):
+        for conn in active_connections.values():
+            conn.send(packet)
+
+    @staticmethod
+    def taken(user_uuid: str):
+        conn = active_connections.get(user_uuid)
+        if conn:
+            conn.disconnect(1000, "Connected elsewhere")
+
+    @staticmethod
+    def invalidate(token: str):
+        auth_cache.invalidate(token)
+
+    @staticmethod
+    def profile(user_uuid: str):
+        profile_cache.invalidate(user_uuid)
+
+
+backplane.attach(LocalDelivery)
+activity.on_flush = backplane.publish_profile
+avatar_events.on_publish = backplane.publish_event
+subscriptions.watcher = backplane.set_interest
+
+
+def avatar_changed(user_uuid: str):
+    # Profiles show the new hash straight away; the EVENT that makes
+    # watchers re-download is debounced.
+    backplane.publish_profile(user_uuid)
+    avatar_events.changed(user_uuid)
+
+
 @router.put("/api/avatar")
-async def upload_avatar(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def upload_avatar(request: Request):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
-    data = await request.body()
+    if not rate_limiter.allow((user.uuid, "upload"), user.upload):
+        return Response(content="Too many requests", status_code=429)
     max_avatar_size = user.max_avatar_size
-    if len(data) > max_avatar_size:
-        return Response(content="Avatar too large", status_code=413)
-    avatar = db.query(Avatar).filter_by(uuid=user.uuid).first()
-    if avatar:
-        avatar.data = data
-    else:
-        db.add(Avatar(uuid=user.uuid, data=data))
-    db.commit()
-    subs = db.query(Subscription).filter_by(target_uuid=user.uuid).all()
-    event_packet = S2C.event(user.uuid)
-    for sub in subs:
-        if sub.user_uuid == user.uuid:
-            continue
-        ws = active_connections.get(sub.user_uuid)
-        if ws:
-            try:
-                await ws.send_bytes(event_packet)
-            except Exception:
-                pass
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        if not content_length.isdigit():
+            return Response(content="Invalid Content-Length", status_code=400)
+        if int(content_length) > max_avatar_size:
+            return Response(content="Avatar too large", status_code=413)
+
+    def store(db, avatar_hash, size):
+        orphaned = None
+        avatar = db.query(Avatar).filter_by(uuid=user.uuid).first()
+        if avatar:
+            if avatar.hash != avatar_hash:
+                blob_store.acquire(db, avatar_hash, size)
+                if blob_store.release(db, avatar.hash):
+                    orphaned = avatar.hash
+                avatar.hash = avatar_hash
+                avatar.size = size
+            avatar.uploaded_at = datetime.utcnow()
+        else:
+            blob_store.acquire(db, avatar_hash, size)
+            db.add(Avatar(uuid=user.uuid, hash=avatar_hash, size=size))
+        db.commit()
+        if orphaned:
+            blob_store.remove(orphaned)
+
+    # Hash and spool the body as it arrives; nothing is held in memory and
+    # an oversized upload is cut off at the first chunk past the limit.
+    writer = await run_in_threadpool(blob_store.writer)
+    try:
+        try:
+            async for chunk in request.stream():
+                if writer.size + len(chunk) > max_avatar_size:
+                    return Response(content="Avatar too large", status_code=413)
+                writer.update(chunk)
+        except ClientDisconnect:
+            return Response(content="Upload interrupted", status_code=400)
+        async with blob_store.lock:
+            avatar_hash = await run_in_threadpool(writer.commit)
+            await run_db(store, avatar_hash, writer.size)
+    finally:
+        writer.abort()
+    avatar_changed(user.uuid)
     return Response(content="Avatar uploaded successfully", status_code=200)
 
 
 @router.delete("/api/avatar")
-async def delete_avatar(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def delete_avatar(request: Request):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
-    avatar = db.query(Avatar).filter_by(uuid=user.uuid).first()
-    if avatar:
+
+    def remove(db):
+        avatar = db.query(Avatar).filter_by(uuid=user.uuid).first()
+        if not avatar:
+            return False
+        orphaned = blob_store.release(db, avatar.hash)
         db.delete(avatar)
         db.commit()
-        subs = db.query(Subscription).filter_by(target_uuid=user.uuid).all()
-        event_packet = S2C.event(user.uuid)
-        for sub in subs:
-            if sub.user_uuid == user.uuid:
-                continue
-            ws = active_connections.get(sub.user_uuid)
-            if ws:
-                try:
-                    await ws.send_bytes(event_packet)
-                except Exception:
-                    pass
+        if orphaned:
+            blob_store.remove(avatar.hash)
+        return True
+
+    async with blob_store.lock:
+        removed = await run_db(remove)
+    if removed:
+        avatar_changed(user.uuid)
         return Response(content="Avatar deleted successfully", status_code=200)
     else:
         return Response(content="No avatar to delete", status_code=404)
 
 
 @router.post("/api/equip")
-async def equip_item(request: Request, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def equip_item(request: Request):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
+    if not rate_limiter.allow((user.uuid, "equip"), user.equip):
+        return Response(content="Too many requests", status_code=429)
     return Response(content="Avatar equipped successfully", status_code=200)
 
 
+def build_profile(uuid: str, user: User, avatar_hash: str):
+    base = {
+        "uuid": user.uuid if user.uuid else uuid,
+        "banned": False,
+        "equipped": [],
+        "equippedBadges": {
+            "special": badges.special(user.equipped_special_badges_mask),
+            "pride": badges.pride(user.equipped_pride_badges_mask)
+        },
+        "lastUsed": user.last_used.isoformat() + "Z" if user.last_used else "",
+        "rank": "normal",
+        "version": user.version if user.version else "unknown"
+    }
+    if avatar_hash:
+        base["equipped"].append({
+            "id": "avatar",
+            "owner": user.uuid,
+            "hash": avatar_hash,
+        })
+    return base
+
+
+def load_profiles(db, uuids):
+    users = {user.uuid: user for user in db.query(User).filter(User.uuid.in_(uuids))}
+    hashes = dict(db.query(Avatar.uuid, Avatar.hash).filter(Avatar.uuid.in_(list(users))))
+    return {uuid: build_profile(uuid, users[uuid], hashes.get(uuid)) for uuid in uuids if uuid in users}
+
+
+def serialize_profile(profile):
+    body = json.dumps(profile, separators=(",", ":")).encode("utf-8")
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+async def cached_profiles(uuids):
+    # uuid -> (body, etag) for every known uuid; misses are loaded with one
+    # query per table and stored back in the cache.
+    found = {}
+    missing = []
+    for uuid in uuids:
+        cached = profile_cache.get(uuid)
+        if cached:
+            found[uuid] = cached
+        else:
+            missing.append(uuid)
+    if missing:
+        generation = profile_cache.generation
+        for uuid, profile in (await run_db(load_profiles, missing)).items():
+            buffered = activity.get(uuid)
+            if buffered:
+                last_used, version = buffered
+                profile["lastUsed"] = last_used.isoformat() + "Z"
+                if version:
+                    profile["version"] = version
+            found[uuid] = serialize_profile(profile)
+            profile_cache.put(uuid, *found[uuid], generation)
+    return found
+
+
+@router.post("/api/profiles")
+async def get_profiles(request: Request):
+    user = await request_user(request)
+    if not user:
+        return Response(content="Invalid token", status_code=403)
+    try:
+        uuids = await request.json()
+    except ValueError:
+        return Response(content="Invalid request body", status_code=400)
+    if not isinstance(uuids, list) or not all(isinstance(uuid, str) for uuid in uuids):
+        return Response(content="Expected a JSON array of UUIDs", status_code=400)
+    uuids = list(dict.fromkeys(uuids))
+    if len(uuids) > CONFIG.get("profileBatchSize", 500):
+        return Response(content="Too many UUIDs", status_code=413)
+    try:
+        found = await cached_profiles(uuids) if uuids else {}
+        body = b"[" + b",".join(
+            found[uuid][0] if uuid in found else serialize_profile({"uuid": uuid})[0]
+            for uuid in uuids) + b"]"
+        return Response(content=body, media_type="application/json")
+    except Exception:
+        return Response(content="Internal Server Error", status_code=500)
+
+
 @router.get("/api/{uuid}")
-async def get_user_by_uuid(request: Request, uuid: str, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def get_user_by_uuid(request: Request, uuid: str):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
     try:
-        user = db.query(User).filter_by(uuid=uuid).first()
-        if not user:
+        cached = (await cached_profiles([uuid])).get(uuid)
+        if not cached:
             return {"uuid": uuid}
-        base = {
-            "uuid": user.uuid if user.uuid else uuid,
-            "banned": False,
-            "equipped": [],
-            "equippedBadges": {
-                "special": [int(x) for x in user.equipped_special_badges.split(",")],
-                "pride": [int(x) for x in user.equipped_pride_badges.split(",")]
-            },
-            "lastUsed": user.last_used.isoformat() + "Z" if user.last_used else "",
-            "rank": "normal",
-            "version": user.version if user.version else "unknown"
-        }
-        avatar = db.query(Avatar).filter_by(uuid=uuid).first()
-        if avatar:
-            avatar_hash = hashlib.sha256(avatar.data).hexdigest()
-            base["equipped"].append({
-                "id": "avatar",
-                "owner": user.uuid,
-                "hash": avatar_hash,
-            })
-        return base
+        body, etag = cached
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
     except Exception:
         return Response(content="Internal Server Error", status_code=500)
 
 
 @router.get("/api/{uuid}/avatar")
-async def download_avatar(request: Request, uuid: str, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def download_avatar(request: Request, uuid: str):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
+    if not rate_limiter.allow((user.uuid, "download"), user.download):
+        return Response(content="Too many requests", status_code=429)
     try:
-        avatar = db.query(Avatar).filter_by(uuid=uuid).first()
-        if not avatar:
+        avatar_hash = await run_db(
+            lambda db: db.query(Avatar.hash).filter_by(uuid=uuid).scalar())
+        if not avatar_hash:
+            return Response(content="Avatar not found", status_code=404)
+        etag = f'"{avatar_hash}"'
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        path = blob_store.path(avatar_hash)
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
             return Response(content="Avatar not found", status_code=404)
-        return Response(content=avatar.data, media_type="application/octet-stream")
+        return metrics.record_served("avatar", FileResponse(
+            path, media_type="application/octet-stream", headers={"ETag": etag}, stat_result=stat_result))
     except Exception:
         return Response(content="Internal Server Error", status_code=500)
 
 
 @router.get("/api/owner/toast")
-async def send_toast(request: Request, title: str, message: str = "", type: int = 0, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def send_toast(request: Request, title: str, message: str = "", type: int = 0):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
     if user.uuid != CONFIG.get("ownerUUID"):
         return Response(content="Forbidden", status_code=403)
-    toast_packet = S2C.toast(type, title, message)
-    for ws in active_connections.values():
-        try:
-            await ws.send_bytes(toast_packet)
-        except Exception:
-            pass
+    backplane.publish_broadcast(S2C.toast(type, title, message))
     return Response(content="Toast sent", status_code=200)
 
 
 @router.get("/api/owner/chat")
-async def send_chat(request: Request, message: str, db: Session = Depends(get_db)):
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+async def send_chat(request: Request, message: str):
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
     if user.uuid != CONFIG.get("ownerUUID"):
         return Response(content="Forbidden", status_code=403)
-    chat_packet = S2C.chat(message)
-    for ws in active_connections.values():
-        try:
-            await ws.send_bytes(chat_packet)
-        except Exception:
-            pass
+    backplane.publish_broadcast(S2C.chat(message))
+
+
+def load_limits(db, uuids):
+    snapshots = []
+    for i in range(0, len(uuids), 500):
+        users = db.query(User).filter(User.uuid.in_(uuids[i:i + 500])).all()
+        snapshots.extend(UserSnapshot.from_user(user) for user in users)
+    return snapshots
+
+
+async def refresh_session_limits():
+    snapshots = await run_db(load_limits, list(active_connections))
+    for snapshot in snapshots:
+        conn = active_connections.get(snapshot.uuid)
+        if conn:
+            conn.session.limits = snapshot
 
 
 @router.get("/api/owner/reload")
-async def reload_config(request: Request, db: Session = Depends(get_db)):
+async def reload_config(request: Request):
     global CONFIG
-    token = request.headers.get("token")
-    user = get_user_by_token(token, db)
+    user = await request_user(request)
     if not user:
         return Response(content="Invalid token", status_code=403)
     if user.uuid != CONFIG.get("ownerUUID"):
@@ -400,45 +579,145 @@ async def reload_config(request: Request, db: Session = Depends(get_db)):
     CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
     with open(CONFIG_PATH, "r") as f:
         CONFIG = json.load(f)
+    auth_cache.configure(*auth_cache_settings())
+    auth_cache.clear()
+    profile_cache.configure(*profile_cache_settings())
+    profile_cache.clear()
+    motd.configure(*motd_settings())
+    avatar_events.configure(CONFIG.get("eventDebounceSeconds", 1))
+    await run_in_threadpool(motd.refresh, True)
+    await refresh_session_limits()
     return Response(content="Config reloaded", status_code=200)
 
 
-class C2S:
-    TOKEN = 0
-    PING = 1
-    SUB = 2
-    UNSUB = 3
+@router.get("/api/owner/stats")
+async def get_stats(request: Request):
+    user = await request_user(request)
+    if not user:
+        return Response(content="Invalid token", status_code=403)
+    if user.uuid != CONFIG.get("ownerUUID"):
+        return Response(content="Forbidden", status_code=403)
+    return {
+        "authCache": auth_cache.stats(),
+        "profileCache": profile_cache.stats(),
+        "activity": activity.stats(),
+        "avatarEvents": avatar_events.stats(),
+        "motd": motd.stats(),
+        "mojang": verifier.stats(),
+        "maintenance": maintenance.stats(),
+        "assetCache": asset_cache.stats(),
+        "sendQueues": queue_metrics(active_connections.values()),
+        "backplane": backplane.stats(),
+        "rateLimiter": rate_limiter.stats(),
+        "dbPool": engine.pool.status()
+    }
 
-    @staticmethod
-    def parse(msg: bytes):
-        if not msg:
-            return None, None
-        msg_type = msg[0]
-        if msg_type == C2S.TOKEN:
-            return C2S.TOKEN, msg[1:].decode('utf-8').strip().replace("\x00", "")
-        elif msg_type == C2S.PING:
-            if len(msg) < 6:
-                return C2S.PING, None
-            ping_id = struct.unpack(">i", msg[1:5])[0]
-            sync = msg[5] != 0
-            data = msg[6:]
-            return C2S.PING, {"id": ping_id, "sync": sync, "data": data}
-        elif msg_type == C2S.SUB or msg_type == C2S.UNSUB:
-            if len(msg) != 17:
-                return msg_type, None
-            target_uuid = str(uuidlib.UUID(bytes=msg[1:17]))
-            return msg_type, {"uuid": target_uuid}
-        else:
-            return msg_type, msg[1:]
+
+metrics.instrument_engine(engine)
+metrics.registry.collected(
+    "nuovo_ws_connections", "Open WebSocket connections.", "gauge", lambda: len(active_connections))
+for name, key, help in (
+        ("nuovo_ws_frames_sent_total", "sent", "Frames written to WebSockets."),
+        ("nuovo_ws_bytes_out_total", "bytesOut", "Bytes written to WebSockets."),
+        ("nuovo_ws_dropped_pings_total", "droppedPings", "Unsynced pings dropped from full send queues."),
+        ("nuovo_ws_coalesced_events_total", "coalescedEvents", "Avatar events merged into one already queued."),
+        ("nuovo_ws_slow_disconnects_total", "slowDisconnects", "Clients disconnected for send queue overflow.")):
+    metrics.registry.collected(name, help, "counter", lambda key=key: queue_stats[key])
+metrics.registry.collected(
+    "nuovo_avatar_changes_total", "Avatar uploads and deletes.", "counter",
+    lambda: avatar_events.changes)
+metrics.registry.collected(
+    "nuovo_avatar_events_collapsed_total", "Avatar changes folded into an already pending EVENT.",
+    "counter", lambda: avatar_events.collapsed)
+metrics.registry.collected(
+    "nuovo_cache_lookups_total", "Auth and profile cache lookups.", "counter",
+    lambda: {(cache_name, result): stats[result]
+             for cache_name, stats in (("auth", auth_cache.stats()), ("profile", profile_cache.stats()))
+             for result in ("hits", "misses")},
+    ("cache", "result"))
+
+
+@router.get("/api/owner/metrics")
+async def get_metrics(request: Request):
+    user = await request_user(request)
+    if not user:
+        return Response(content="Invalid token", status_code=403)
+    if user.uuid != CONFIG.get("ownerUUID"):
+        return Response(content="Forbidden", status_code=403)
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 
-ping_stats = defaultdict(lambda: {"count": 0, "bytes": 0, "reset": 0})
+stack_sampler = StackSampler()
+memory_tracer = MemoryTracer()
+loop_monitor = LoopMonitor()
+
+
+def profiling_max_seconds():
+    return CONFIG.get("profiling", {}).get("maxSeconds", 60)
+
+
+@router.get("/api/owner/profile/cpu")
+async def profile_cpu(request: Request, seconds: float = 5, interval: float = 0.005):
+    user = await request_user(request)
+    if not user:
+        return Response(content="Invalid token", status_code=403)
+    if user.uuid != CONFIG.get("ownerUUID"):
+        return Response(content="Forbidden", status_code=403)
+    if not 0 < seconds <= profiling_max_seconds() or not 0.001 <= interval <= 1:
+        return Response(content="Invalid duration or interval", status_code=400)
+    counts = await run_in_threadpool(stack_sampler.sample, seconds, interval)
+    if counts is None:
+        return Response(content="A profile is already running", status_code=409)
+    return Response(content=stack_sampler.render(counts), media_type="text/plain")
+
+
+@router.get("/api/owner/profile/memory")
+async def profile_memory(request: Request, action: str = "snapshot", frames: int = 1,
+                         limit: int = 25, key: str = "lineno"):
+    user = await request_user(request)
+    if not user:
+        return Response(content="Invalid token", status_code=403)
+    if user.uuid != CONFIG.get("ownerUUID"):
+        return Response(content="Forbidden", status_code=403)
+    if action == "start":
+        if not 1 <= frames <= 50:
+            return Response(content="Invalid frame count", status_code=400)
+        memory_tracer.start(frames)
+        return Response(content="Tracing started", status_code=200)
+    if action == "stop":
+        memory_tracer.stop()
+        return Response(content="Tracing stopped", status_code=200)
+    if action != "snapshot" or key not in ("lineno", "filename", "traceback"):
+        return Response(content="Invalid action or key", status_code=400)
+    if not memory_tracer.tracing:
+        return Response(content="Tracing is not running", status_code=409)
+    return await run_in_threadpool(memory_tracer.snapshot, max(1, limit), key)
+
+
+@router.get("/api/owner/profile/loop")
+async def profile_loop(request: Request, action: str = "stats", seconds: float = 60,
+                       threshold: float = 0.1):
+    user = await request_user(request)
+    if not user:
+        return Response(content="Invalid token", status_code=403)
+    if user.uuid != CONFIG.get("ownerUUID"):
+        return Response(content="Forbidden", status_code=403)
+    if action == "start":
+        if not 0 < seconds <= profiling_max_seconds() or not 0.01 <= threshold <= 10:
+            return Response(content="Invalid duration or threshold", status_code=400)
+        loop_monitor.start(seconds, threshold)
+    elif action == "stop":
+        loop_monitor.stop()
+    elif action != "stats":
+        return Response(content="Invalid action", status_code=400)
+    return loop_monitor.stats()
 
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    user = None
+    session = None
+    conn = None
     try:
         msg = await websocket.receive_bytes()
         msg_type, payload = C2S.parse(msg)
@@ -446,69 +725,58 @@ async def websocket_endpoint(websocket: WebSocket, db: Session = Depends(get_db)
             await websocket.close(code=3000, reason="Authentication failure")
             return
         token = payload
-        user = get_user_by_token(token, db)
+        user = await get_user_by_token(token)
         if not user:
             await websocket.close(code=3000, reason="Authentication failure")
             return
-        active_connections[user.uuid] = websocket
-        await websocket.send_bytes(S2C.auth())
+        session = ClientSession(user)
+        queue_settings = CONFIG.get("sendQueue", {})
+        conn = Connection(websocket, session, queue_settings.get("maxSize", 256),
+                          queue_settings.get("overLimitSeconds", 5))
+        previous = active_connections.get(session.uuid)
+        if previous:
+            previous.disconnect(1000, "Connected elsewhere")
+        active_connections[session.uuid] = conn
+        backplane.set_presence(session.uuid, True)
+        await subscriptions.load_user(session.uuid)
+        conn.send(S2C.auth())
 
         while True:
             try:
                 msg = await websocket.receive_bytes()
                 msg_type, payload = C2S.parse(msg)
-                now = int(time.time())
-                stats = ping_stats[user.uuid]
-                if stats["reset"] != now:
-                    stats["reset"] = now
-                    stats["count"] = 0
-                    stats["bytes"] = 0
                 if msg_type == C2S.PING and payload:
-                    ping_size_limit = user.ping_size
-                    ping_rate_limit = user.ping_rate
-                    ping_id = payload["id"]
-                    sync = payload["sync"]
-                    data = payload["data"]
+                    ping_id, sync, data = payload
                     total_size = len(data)
-                    if stats["count"] + 1 > ping_rate_limit:
-                        await websocket.send_bytes(S2C.notice(S2C.NoticeType.RATE))
+                    limits = session.limits
+                    if session.ping_count.tokens(limits.ping_rate, limits.ping_rate) < 1:
+                        conn.send(S2C.notice(S2C.NoticeType.RATE))
+                        metrics.ws_notices.inc(1, ("rate",))
                         continue
-                    if stats["bytes"] + total_size > ping_size_limit:
-                        await websocket.send_bytes(S2C.notice(S2C.NoticeType.SIZE))
+                    if session.ping_bytes.tokens(limits.ping_size, limits.ping_size) < total_size:
+                        conn.send(S2C.notice(S2C.NoticeType.SIZE))
+                        metrics.ws_notices.inc(1, ("size",))
                         continue
-                    stats["count"] += 1
-                    stats["bytes"] += total_size
-                    target_uuid = user.uuid
-                    subs = db.query(Subscription).filter_by(
-                        target_uuid=target_uuid).all()
-                    packet = S2C.ping(target_uuid, ping_id, sync, data)
-                    for sub in subs:
-                        ws = active_connections.get(sub.user_uuid)
-                        if user.uuid == sub.user_uuid and not sync:
-                            continue
-                        if ws:
-                            try:
-                                await ws.send_bytes(packet)
-                            except Exception:
-                                pass
+                    session.ping_count.take()
+                    session.ping_bytes.take(total_size)
+                    packet = S2C.ping(session.ping_header, ping_id, sync, data)
+                    backplane.publish_ping(session.uuid, packet, sync)
+                    metrics.ws_pings.inc()
                 elif msg_type == C2S.SUB and payload:
-                    target_uuid = payload["uuid"]
-                    if not db.query(Subscription).filter_by(user_uuid=user.uuid, target_uuid=target_uuid).first():
-                        db.add(Subscription(user_uuid=user.uuid,
-                               target_uuid=target_uuid))
-                        db.commit()
+                    await subscriptions.subscribe(session.uuid, payload)
                 elif msg_type == C2S.UNSUB and payload:
-                    target_uuid = payload["uuid"]
-                    db.query(Subscription).filter_by(
-                        user_uuid=user.uuid, target_uuid=target_uuid).delete()
-                    db.commit()
+                    await subscriptions.unsubscribe(session.uuid, payload)
             except WebSocketDisconnect:
                 break
             except Exception:
                 break
     finally:
-        if user:
-            active_connections.pop(user.uuid, None)
+        if conn:
+            await conn.stop()
+            if active_connections.get(session.uuid) is conn:
+                del active_connections[session.uuid]
+                subscriptions.drop_user(session.uuid)
+                backplane.set_presence(session.uuid, False)
         try:
             await websocket.close(code=1011, reason="Unexpected error")
         except Exception:
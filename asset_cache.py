@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from httputil import accepted_encodings, etag_matches, parse_range
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressing tiny files only adds framing overhead.
+MIN_COMPRESS_SIZE = 256
+
+
+class CachedAsset:
+    __slots__ = ("data", "gzip", "br", "etag", "size")
+
+    def __init__(self, data: bytes, etag: str):
+        self.data = data
+        self.etag = etag
+        self.gzip = None
+        self.br = None
+        if len(data) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                self.gzip = compressed
+            if brotli:
+                compressed = brotli.compress(data)
+                if len(compressed) < len(data):
+                    self.br = compressed
+        self.size = len(data) + len(self.gzip or b"") + len(self.br or b"")
+
+
+class AssetCache:
+    def __init__(self, root: str, memory_budget: int):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.index = None
+        self.index_bytes = None
+        self.index_etag = None
+        self._files = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        with open(os.path.join(self.root, "v2.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        index_bytes = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self.index = index
+            self.index_bytes = index_bytes
+            self.index_etag = '"' + hashlib.sha1(index_bytes).hexdigest() + '"'
+            self._files.clear()
+            self._used = 0
+
+    def ensure_loaded(self):
+        if self.index is None:
+            self.load()
+
+    def _cached(self, asset_path: str):
+        with self._lock:
+            asset = self._files.get(asset_path)
+            if asset:
+                self._files.move_to_end(asset_path)
+            return asset
+
+    def _read(self, asset_path: str, etag: str):
+        with open(os.path.join(self.root, "v2", asset_path), "rb") as f:
+            asset = CachedAsset(f.read(), etag)
+        with self._lock:
+            if self.index.get(asset_path) != etag.strip('"'):
+                return asset
+            previous = self._files.pop(asset_path, None)
+            if previous:
+                self._used -= previous.size
+            self._files[asset_path] = asset
+            self._used += asset.size
+            while self._used > self.memory_budget and self._files:
+                _, evicted = self._files.popitem(last=False)
+                self._used -= evicted.size
+        return asset
+
+    def index_response(self, request: Request):
+        etag = self.index_etag
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=self.index_bytes, media_type="application/json", headers={"ETag": etag})
+
+    async def serve(self, request: Request, asset_path: str):
+        file_hash = self.index.get(asset_path)
+        if not file_hash:
+            return Response(content="Asset not found", status_code=404)
+        etag = f'"{file_hash}"'
+        headers = {"ETag": etag, "Accept-Ranges": "bytes", "Vary": "Accept-Encoding"}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+        asset = self._cached(asset_path)
+        if not asset:
+            path = os.path.join(self.root, "v2", asset_path)
+            try:
+                stat_result = os.stat(path)
+                if stat_result.st_size * 2 > self.memory_budget:
+                    return FileResponse(path, media_type="application/octet-stream",
+                                        headers={"ETag": etag}, stat_result=stat_result)
+                asset = await run_in_threadpool(self._read, asset_path, etag)
+            except OSError:
+                return Response(content="Asset not found", status_code=404)
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (not if_range or if_range == etag):
+            byte_range = parse_range(range_header, len(asset.data))
+            if byte_range is False:
+                headers["Content-Range"] = f"bytes */{len(asset.data)}"
+                return Response(status_code=416, headers=headers)
+            if byte_range:
+                start, end = byte_range
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(asset.data)}"
+                return Response(content=asset.data[start:end + 1], status_code=206,
+                                media_type="application/octet-stream", headers=headers)
+
+        encodings = accepted_encodings(request.headers.get("accept-encoding", ""))
+        if asset.br and "br" in encodings:
+            headers["Content-Encoding"] = "br"
+            return Response(content=asset.br, media_type="application/octet-stream", headers=headers)
+        if asset.gzip and "gzip" in encodings:
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=asset.gzip, media_type="application/octet-stream", headers=headers)
+        return Response(content=asset.data, media_type="application/octet-stream", headers=headers)
+
+    def stats(self):
+        return {
+            "files": len(self._files),
+            "bytes": self._used,
+            "budget": self.memory_budget,
+        }
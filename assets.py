@@ -0,0 +1,186 @@
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile
+import requests
+
+logger = logging.getLogger("uvicorn.error")
+
+# Below this many changed files a process pool costs more than it saves.
+POOL_THRESHOLD = 64
+
+
+def calculate_file_hash(file_path):
+    hash_func = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            hash_func.update(chunk)
+    return hash_func.hexdigest()
+
+
+def hash_files(paths, workers=None):
+    if len(paths) < POOL_THRESHOLD or workers == 1:
+        return [calculate_file_hash(path) for path in paths]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return list(pool.map(calculate_file_hash, paths, chunksize=16))
+
+
+def generate_file_index(directory, manifest=None, workers=None, signatures=None):
+    # signatures maps relative path -> [size, crc32] from the archive's
+    # central directory, and manifest maps relative path -> [size, crc32,
+    # sha256]. Timestamps are useless here: GitHub stamps every entry with
+    # the commit time, so each upstream change would touch every file.
+    manifest = manifest or {}
+    signatures = signatures or {}
+    file_index = {}
+    new_manifest = {}
+    stale = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(
+                file_path, directory).replace("\\", "/")
+            signature = signatures.get(relative_path)
+            entry = manifest.get(relative_path)
+            if signature and entry and entry[:2] == signature:
+                file_index[relative_path] = entry[2]
+                new_manifest[relative_path] = entry
+            else:
+                stale.append((relative_path, file_path, signature))
+    hashes = hash_files([file_path for _, file_path, _ in stale], workers)
+    for (relative_path, _, signature), file_hash in zip(stale, hashes):
+        file_index[relative_path] = file_hash
+        if signature:
+            new_manifest[relative_path] = [*signature, file_hash]
+    return dict(sorted(file_index.items())), new_manifest
+
+
+def load_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, data, **kwargs):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def extract_archive(archive, destination):
+    # Members are streamed out of the on-disk archive one at a time. Returns
+    # name -> [size, crc32] for each file, read from the central directory.
+    signatures = {}
+    with ZipFile(archive) as zip_file:
+        for member in zip_file.infolist():
+            zip_file.extract(member, destination)
+            if not member.is_dir():
+                signatures[member.filename] = [member.file_size, member.CRC]
+    return signatures
+
+
+class AssetSync:
+    def __init__(self, url: str, assets_dir: str, workers=None, on_update=None):
+        self.url = url
+        self.assets_dir = assets_dir
+        self.workers = workers
+        self.on_update = on_update
+        self.current = os.path.join(assets_dir, "Assets-main")
+        self.state_path = os.path.join(assets_dir, ".sync.json")
+        self.manifest_path = os.path.join(assets_dir, ".manifest.json")
+        self.lock_path = os.path.join(assets_dir, ".sync.lock")
+        self._thread = None
+
+    def has_assets(self):
+        return os.path.isfile(os.path.join(self.current, "v2.json"))
+
+    def start(self):
+        os.makedirs(self.assets_dir, exist_ok=True)
+        if not self.has_assets():
+            self.refresh()
+            return
+        self._thread = threading.Thread(
+            target=self.refresh, name="asset-sync", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        try:
+            if self.sync():
+                logger.info("Assets updated from %s", self.url)
+                if self.on_update:
+                    self.on_update()
+            else:
+                logger.info("Assets are up to date")
+        except Exception:
+            logger.exception("Asset sync failed, serving the last good set")
+
+    def sync(self):
+        # Every worker syncs at startup. The flock makes them take turns, so
+        # later ones find the fresh set and usually get a 304.
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return self._sync()
+        finally:
+            os.close(fd)
+
+    def _sync(self):
+        # Only the lock holder stages, so anything left over is from a
+        # process that died mid-sync.
+        for leftover in glob.glob(os.path.join(self.assets_dir, ".staging*")):
+            shutil.rmtree(leftover, ignore_errors=True)
+        state = load_json(self.state_path, {})
+        headers = {}
+        if self.has_assets():
+            if state.get("etag"):
+                headers["If-None-Match"] = state["etag"]
+            if state.get("lastModified"):
+                headers["If-Modified-Since"] = state["lastModified"]
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.assets_dir)
+        try:
+            with requests.get(self.url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                if response.status_code == 304:
+                    return False
+                response.raise_for_status()
+                with tempfile.TemporaryFile(dir=self.assets_dir) as archive:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        archive.write(chunk)
+                    archive.seek(0)
+                    members = extract_archive(archive, staging)
+                new_state = {
+                    "etag": response.headers.get("ETag"),
+                    "lastModified": response.headers.get("Last-Modified"),
+                }
+
+            staged = os.path.join(staging, "Assets-main")
+            manifest = load_json(self.manifest_path, {})
+            prefix = "Assets-main/v2/"
+            signatures = {name[len(prefix):]: signature for name, signature in members.items()
+                          if name.startswith(prefix)}
+            file_index, manifest = generate_file_index(
+                os.path.join(staged, "v2"), manifest, self.workers, signatures)
+            with open(os.path.join(staged, "v2.json"), "w", encoding="utf-8") as f:
+                json.dump(file_index, f, indent=4)
+
+            # The old set is moved into the staging directory and goes with it.
+            if os.path.exists(self.current):
+                os.rename(self.current, os.path.join(staging, "previous"))
+            os.rename(staged, self.current)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        save_json(self.manifest_path, manifest)
+        save_json(self.state_path, new_state)
+        return True
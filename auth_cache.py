@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    uuid: str
+    username: str
+    ping_size: int
+    ping_rate: int
+    equip: int
+    download: int
+    upload: int
+    max_avatar_size: int
+    max_avatars: int
+    special_badges_mask: int
+    pride_badges_mask: int
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            uuid=user.uuid,
+            username=user.username,
+            ping_size=user.ping_size,
+            ping_rate=user.ping_rate,
+            equip=user.equip,
+            download=user.download,
+            upload=user.upload,
+            max_avatar_size=user.max_avatar_size,
+            max_avatars=user.max_avatars,
+            special_badges_mask=user.special_badges_mask,
+            pride_badges_mask=user.pride_badges_mask,
+        )
+
+
+class AuthCache:
+    # token -> (expires_at, UserSnapshot), least recently used first
+    def __init__(self, ttl: float = 60, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return snapshot
+
+    def put(self, token: str, snapshot: UserSnapshot):
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def configure(self, ttl: float, max_size: int):
+        with self._lock:
+            self.ttl = ttl
+            self.max_size = max_size
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,390 @@
+import asyncio
+import fcntl
+import logging
+import os
+import socket
+import struct
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class Op:
+    HELLO = 0
+    INTEREST = 1
+    UNINTEREST = 2
+    PRESENCE = 3
+    ABSENCE = 4
+    PING = 5
+    EVENT = 6
+    BROADCAST = 7
+    INVALIDATE = 8
+    PROFILE = 9
+
+
+FRAME_HEADER = struct.Struct(">IB")
+UUID_LEN = 36
+
+
+class Backplane(ABC):
+    # Routes pings, avatar events and owner broadcasts to whichever process
+    # holds the subscriber. The handler does the local delivery and must
+    # provide ping(target, packet, sync), event(target), broadcast(packet),
+    # taken(uuid), invalidate(token) and profile(uuid).
+    def __init__(self):
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.handler = None
+        self.directory = {}
+
+    def attach(self, handler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    def publish_ping(self, target_uuid: str, packet: bytes, sync: bool):
+        pass
+
+    @abstractmethod
+    def publish_event(self, target_uuid: str):
+        pass
+
+    @abstractmethod
+    def publish_broadcast(self, packet: bytes):
+        pass
+
+    @abstractmethod
+    def publish_invalidate(self, token: str):
+        pass
+
+    @abstractmethod
+    def publish_profile(self, user_uuid: str):
+        pass
+
+    @abstractmethod
+    def set_interest(self, target_uuid: str, interested: bool):
+        pass
+
+    @abstractmethod
+    def set_presence(self, user_uuid: str, present: bool):
+        pass
+
+    def stats(self):
+        return {
+            "node": self.node_id,
+            "type": type(self).__name__,
+            "present": len(self.directory),
+        }
+
+
+class InProcessBackplane(Backplane):
+    def publish_ping(self, target_uuid: str, packet: bytes, sync: bool):
+        self.handler.ping(target_uuid, packet, sync)
+
+    def publish_event(self, target_uuid: str):
+        self.handler.event(target_uuid)
+
+    def publish_broadcast(self, packet: bytes):
+        self.handler.broadcast(packet)
+
+    def publish_invalidate(self, token: str):
+        self.handler.invalidate(token)
+
+    def publish_profile(self, user_uuid: str):
+        self.handler.profile(user_uuid)
+
+    def set_interest(self, target_uuid: str, interested: bool):
+        pass
+
+    def set_presence(self, user_uuid: str, present: bool):
+        if present:
+            self.directory[user_uuid] = self.node_id
+        elif self.directory.get(user_uuid) == self.node_id:
+            del self.directory[user_uuid]
+
+
+def encode_frame(op: int, payload: bytes):
+    return FRAME_HEADER.pack(len(payload) + 1, op) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length, op = FRAME_HEADER.unpack(header)
+    return op, await reader.readexactly(length - 1)
+
+
+class Broker:
+    # Runs inside whichever worker bound the socket first. Nodes register
+    # interest in targets that have local subscribers, so pings and events
+    # only cross to processes that can deliver them.
+    def __init__(self, local):
+        self.local = local
+        self.peers = {}
+        self.interest = {}
+        self.directory = {}
+        self.server = None
+        # connection handler task -> its writer
+        self._handlers = {}
+
+    async def start(self, path: str):
+        self.server = await asyncio.start_unix_server(self._serve, path=path)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        # Closing the sockets lets each handler finish on its own; the
+        # streams server logs handler tasks that end cancelled.
+        for writer in self._handlers.values():
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self.server:
+            await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        node_id = None
+        handler = asyncio.current_task()
+        self._handlers[handler] = writer
+        try:
+            op, payload = await read_frame(reader)
+            if op != Op.HELLO:
+                return
+            node_id = payload.decode()
+            self.peers[node_id] = writer
+            for user_uuid, owner in self.directory.items():
+                writer.write(encode_frame(
+                    Op.PRESENCE, user_uuid.encode() + owner.encode()))
+            while True:
+                op, payload = await read_frame(reader)
+                self.route(node_id, op, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._handlers.pop(handler, None)
+            if node_id:
+                self._drop_peer(node_id)
+            writer.close()
+
+    def _drop_peer(self, node_id: str):
+        self.peers.pop(node_id, None)
+        for target_uuid in [t for t, nodes in self.interest.items() if node_id in nodes]:
+            self._set_interest(node_id, target_uuid, False)
+        for user_uuid in [u for u, owner in self.directory.items() if owner == node_id]:
+            self.route(node_id, Op.ABSENCE, user_uuid.encode() + node_id.encode())
+
+    def _set_interest(self, node_id: str, target_uuid: str, interested: bool):
+        nodes = self.interest.setdefault(target_uuid, set())
+        if interested:
+            nodes.add(node_id)
+        else:
+            nodes.discard(node_id)
+            if not nodes:
+                del self.interest[target_uuid]
+
+    def _send(self, node_id: str, op: int, payload: bytes, frame: bytes):
+        if node_id == self.local.node_id:
+            self.local.receive(op, payload)
+            return
+        writer = self.peers.get(node_id)
+        if writer and not writer.is_closing():
+            writer.write(frame)
+
+    def route(self, origin: str, op: int, payload: bytes):
+        if op in (Op.INTEREST, Op.UNINTEREST):
+            self._set_interest(origin, payload.decode(), op == Op.INTEREST)
+            return
+        frame = encode_frame(op, payload)
+        if op in (Op.PING, Op.EVENT):
+            target_uuid = payload[:UUID_LEN].decode()
+            for node_id in tuple(self.interest.get(target_uuid, ())):
+                if node_id != origin:
+                    self._send(node_id, op, payload, frame)
+            return
+        if op in (Op.PRESENCE, Op.ABSENCE):
+            user_uuid = payload[:UUID_LEN].decode()
+            owner = payload[UUID_LEN:].decode()
+            if op == Op.PRESENCE:
+                self.directory[user_uuid] = owner
+            elif self.directory.get(user_uuid) == owner:
+                del self.directory[user_uuid]
+            else:
+                return
+        for node_id in (self.local.node_id, *self.peers):
+            if node_id != origin or op in (Op.PRESENCE, Op.ABSENCE):
+                self._send(node_id, op, payload, frame)
+
+
+class UnixSocketBackplane(Backplane):
+    # Every worker on the box connects to one Unix-domain socket. The first
+    # worker to bind it hosts the broker; if that worker exits, the others
+    # reconnect and one of them takes over.
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.broker = None
+        self.interests = set()
+        self.present = set()
+        self._writer = None
+        self._task = None
+        self._lock_fd = None
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        reader = await self._connect()
+        # The broker delivers to itself directly; only a client connection
+        # needs reading and, once lost, reconnecting.
+        if reader is not None:
+            self._task = asyncio.create_task(self._supervise(reader))
+
+    async def stop(self):
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self.broker:
+            await self.broker.stop()
+            self.broker = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _take_broker_lock(self):
+        # The broker role is guarded by an flock so two workers never unlink
+        # each other's socket; the kernel releases it if the holder dies.
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def _connect(self):
+        self.broker = None
+        self._writer = None
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self._take_broker_lock():
+                    if os.path.exists(self.path):
+                        os.unlink(self.path)
+                    broker = Broker(self)
+                    await broker.start(self.path)
+                    self.broker = broker
+                    self._resync()
+                    logger.info("Backplane broker listening on %s", self.path)
+                    return None
+                await asyncio.sleep(0.1)
+        self._writer = writer
+        writer.write(encode_frame(Op.HELLO, self.node_id.encode()))
+        self._resync()
+        return reader
+
+    def _resync(self):
+        for target_uuid in self.interests:
+            self._publish(Op.INTEREST, target_uuid.encode())
+        for user_uuid in self.present:
+            self._publish(Op.PRESENCE, user_uuid.encode() + self.node_id.encode())
+
+    async def _supervise(self, reader):
+        while not self._stopping:
+            try:
+                if reader is None:
+                    reader = await self._connect()
+                    if reader is None:
+                        # Took over as broker.
+                        return
+                while True:
+                    op, payload = await read_frame(reader)
+                    self.receive(op, payload)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                logger.warning("Backplane connection lost, reconnecting")
+                reader = None
+                self.directory.clear()
+                await asyncio.sleep(0.5)
+
+    def _publish(self, op: int, payload: bytes):
+        if self.broker:
+            self.broker.route(self.node_id, op, payload)
+        elif self._writer and not self._writer.is_closing():
+            self._writer.write(encode_frame(op, payload))
+
+    def receive(self, op: int, payload: bytes):
+        if op == Op.PING:
+            self.handler.ping(payload[:UUID_LEN].decode(), payload[UUID_LEN + 1:], payload[UUID_LEN] != 0)
+        elif op == Op.EVENT:
+            self.handler.event(payload[:UUID_LEN].decode())
+        elif op == Op.BROADCAST:
+            self.handler.broadcast(payload)
+        elif op == Op.INVALIDATE:
+            self.handler.invalidate(payload.decode())
+        elif op == Op.PROFILE:
+            self.handler.profile(payload.decode())
+        elif op == Op.PRESENCE:
+            user_uuid = payload[:UUID_LEN].decode()
+            owner = payload[UUID_LEN:].decode()
+            self.directory[user_uuid] = owner
+            if owner != self.node_id and user_uuid in self.present:
+                self.present.discard(user_uuid)
+                self.handler.taken(user_uuid)
+        elif op == Op.ABSENCE:
+            user_uuid = payload[:UUID_LEN].decode()
+            if self.directory.get(user_uuid) == payload[UUID_LEN:].decode():
+                del self.directory[user_uuid]
+
+    def publish_ping(self, target_uuid: str, packet: bytes, sync: bool):
+        self.handler.ping(target_uuid, packet, sync)
+        self._publish(Op.PING, target_uuid.encode() + bytes([sync]) + packet)
+
+    def publish_event(self, target_uuid: str):
+        self.handler.event(target_uuid)
+        self._publish(Op.EVENT, target_uuid.encode())
+
+    def publish_broadcast(self, packet: bytes):
+        self.handler.broadcast(packet)
+        self._publish(Op.BROADCAST, packet)
+
+    def publish_invalidate(self, token: str):
+        self.handler.invalidate(token)
+        self._publish(Op.INVALIDATE, token.encode())
+
+    def publish_profile(self, user_uuid: str):
+        self.handler.profile(user_uuid)
+        self._publish(Op.PROFILE, user_uuid.encode())
+
+    def set_interest(self, target_uuid: str, interested: bool):
+        if interested:
+            self.interests.add(target_uuid)
+            self._publish(Op.INTEREST, target_uuid.encode())
+        else:
+            self.interests.discard(target_uuid)
+            self._publish(Op.UNINTEREST, target_uuid.encode())
+
+    def set_presence(self, user_uuid: str, present: bool):
+        if present:
+            self.present.add(user_uuid)
+            self._publish(Op.PRESENCE, user_uuid.encode() + self.node_id.encode())
+        else:
+            self.present.discard(user_uuid)
+            self._publish(Op.ABSENCE, user_uuid.encode() + self.node_id.encode())
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "broker": self.broker is not None,
+            "peers": len(self.broker.peers) if self.broker else None,
+            "interests": len(self.interests),
+        }
+
+
+def create_backplane(settings: dict):
+    if settings.get("type", "inprocess") == "unix":
+        return UnixSocketBackplane(settings.get("socketPath", "/tmp/nuovo-backplane.sock"))
+    return InProcessBackplane()
@@ -0,0 +1,32 @@
+from functools import lru_cache
+
+# Badge flags are stored as integer bitmasks, bit i for badge i, and only
+# expanded into the 0/1 lists the client expects when serialising.
+SPECIAL_COUNT = 6
+PRIDE_COUNT = 25
+
+
+def pack(flags):
+    mask = 0
+    for i, flag in enumerate(flags):
+        if int(flag):
+            mask |= 1 << i
+    return mask
+
+
+def parse(text):
+    # Legacy comma-joined form, e.g. "0,1,0,0,0,0".
+    return pack(x for x in (text or "").split(",") if x.strip())
+
+
+@lru_cache(maxsize=1024)
+def unpack(mask, count):
+    return tuple((mask >> i) & 1 for i in range(count))
+
+
+def special(mask):
+    return unpack(mask or 0, SPECIAL_COUNT)
+
+
+def pride(mask):
+    return unpack(mask or 0, PRIDE_COUNT)
@@ -0,0 +1,58 @@
+"""Microbenchmarks for the WebSocket packet codec.
+
+Times encoding and decoding of each hot packet type in nanoseconds per
+packet, so codec changes can be compared run to run:
+
+    python bench/codec_bench.py --sizes 16 1024 16384
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import timeit
+
+from common import REPO, user_uuid
+
+
+def ns_per_op(stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=5))
+    return round(best / number * 1e9, 1)
+
+
+def run(args):
+    sys.path.insert(0, args.repo)
+    from codec import C2S, S2C, uuid_to_bytes
+
+    uuid = user_uuid(1)
+    header = S2C.ping_header(uuid_to_bytes(uuid))
+    sub_frame = bytes([C2S.SUB]) + uuid_to_bytes(uuid)
+    results = {
+        "encode_event": ns_per_op(lambda: S2C.event(uuid), args.number),
+        "decode_sub": ns_per_op(lambda: C2S.parse(sub_frame), args.number),
+        "decode_token": ns_per_op(lambda: C2S.parse(b"\x00" + b"t" * 32), args.number),
+    }
+    for size in args.sizes:
+        frame = bytes([C2S.PING]) + struct.pack(">ib", 7, 1) + os.urandom(size)
+
+        def relay():
+            ping_id, sync, data = C2S.parse(frame)[1]
+            return S2C.ping(header, ping_id, sync, data)
+
+        results[f"decode_ping_{size}"] = ns_per_op(lambda: C2S.parse(frame), args.number)
+        results[f"relay_ping_{size}"] = ns_per_op(relay, args.number)
+    return {"label": args.label, **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repo", default=REPO, help="checkout to benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 1024, 16384])
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--label", default="")
+    args = parser.parse_args()
+    print(json.dumps(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Shared helpers for the benchmark scripts.
+
+Server copies a checkout's modules into a temporary directory, seeds users
+``bench0``..``benchN`` (uuid from user_uuid(i), token ``token<i>``) with
+generous limits, and runs uvicorn there, so benchmarks never touch the real
+config, database or assets.
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid as uuidlib
+
+import httpx
+import websockets
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = """
+import sys
+from database import Base, SessionLocal, engine
+from models import Token, User
+
+Base.metadata.create_all(bind=engine)
+db = SessionLocal()
+for i in range(int(sys.argv[1])):
+    user_uuid = "%08x-0000-4000-8000-000000000000" % i
+    db.add(User(uuid=user_uuid, username="bench%d" % i, ping_rate=1000,
+                ping_size=1 << 20, upload=1000, download=1000, equip=1000,
+                max_avatar_size=1 << 20))
+    db.flush()
+    db.add(Token(token="token%d" % i, user_uuid=user_uuid))
+db.commit()
+"""
+
+
+def user_uuid(i):
+    return "%08x-0000-4000-8000-000000000000" % i
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def tree_rss_kb(pid):
+    # RSS of a process plus its direct children, e.g. uvicorn and its workers.
+    total = rss_kb(pid)
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+    for child in children:
+        try:
+            total += rss_kb(int(child))
+        except OSError:
+            pass
+    return total
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Server:
+    def __init__(self, repo=REPO, users=2, config=None, workers=1, local_assets=True):
+        self.repo = repo
+        self.users = users
+        self.config = config or {}
+        self.workers = workers
+        self.local_assets = local_assets
+        self.workdir = None
+        self.process = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def ws_url(self):
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    def prepare(self):
+        self.workdir = tempfile.mkdtemp(prefix="nuovo-bench-")
+        for name in os.listdir(self.repo):
+            if name.endswith(".py"):
+                shutil.copy(os.path.join(self.repo, name), self.workdir)
+        with open(os.path.join(self.repo, "config-example.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        config["ownerUUID"] = user_uuid(0)
+        # Nothing listens here: the server boots from the local asset set.
+        config["assetsUrl"] = "http://127.0.0.1:9/assets.zip"
+        config.update(self.config)
+        with open(os.path.join(self.workdir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        assets = os.path.join(self.workdir, "assets", "Assets-main")
+        if self.local_assets and not os.path.exists(assets):
+            os.makedirs(os.path.join(assets, "v2"))
+            with open(os.path.join(assets, "v2.json"), "w") as f:
+                f.write("{}")
+        with open(os.path.join(self.workdir, "seed.py"), "w") as f:
+            f.write(SEED)
+        subprocess.run([sys.executable, "seed.py", str(self.users)],
+                       cwd=self.workdir, check=True)
+
+    async def __aenter__(self):
+        if self.workdir is None:
+            self.prepare()
+        self.port = free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port),
+             "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=self.workdir, stderr=subprocess.DEVNULL)
+        await wait_until_up(self.base_url)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+async def wait_until_up(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(base_url + "/")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def connect(ws_url, token, targets=()):
+    ws = await websockets.connect(ws_url, max_size=None, ping_interval=None)
+    await ws.send(b"\x00" + token.encode())
+    await ws.recv()
+    for target in targets:
+        await ws.send(b"\x02" + uuidlib.UUID(target).bytes)
+    return ws
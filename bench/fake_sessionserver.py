@@ -0,0 +1,61 @@
+"""Local stand-in for Mojang's session server.
+
+Answers /session/minecraft/hasJoined like sessionserver.mojang.com, with
+offline-mode uuids derived from the username, so logins can be exercised
+without the real service. Point the backend at it with
+"mojang": {"sessionServer": "http://127.0.0.1:8765"}:
+
+    python bench/fake_sessionserver.py --port 8765 --latency 0.05
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import uuid as uuidlib
+
+import uvicorn
+from fastapi import FastAPI, Response
+
+
+def offline_uuid(username):
+    digest = bytearray(hashlib.md5(f"OfflinePlayer:{username}".encode()).digest())
+    digest[6] = digest[6] & 0x0f | 0x30
+    digest[8] = digest[8] & 0x3f | 0x80
+    return uuidlib.UUID(bytes=bytes(digest))
+
+
+def create_app(latency=0.0, fail_rate=0.0):
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.get("/session/minecraft/hasJoined")
+    async def has_joined(username: str, serverId: str):
+        app.state.requests += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if random.random() < fail_rate:
+            return Response(status_code=503)
+        if username.startswith("reject"):
+            return Response(status_code=204)
+        return {"id": offline_uuid(username).hex, "name": username, "properties": []}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each answer")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction answered with 503")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency, args.fail_rate), host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
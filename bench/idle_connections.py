@@ -0,0 +1,117 @@
+"""Idle WebSocket load test.
+
+Opens thousands of authenticated, idle /ws connections and checks that the
+server still answers HTTP promptly (no database pool starvation) and how
+much resident memory each connection costs:
+
+    python bench/idle_connections.py --connections 10000
+
+Exits non-zero if any socket was refused, the database pool has
+connections checked out while the sockets sit idle, or RSS per connection
+or HTTP p99 goes over its budget. Baseline with 10000 sockets: all
+accepted, 0 checked out, ~80 KB per connection (81 -> 865 MB), HTTP p99
+~2.2 s with the client on the same box. The default budgets leave
+headroom above that.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+
+from common import REPO, Server, connect, percentile, rss_kb, user_uuid
+
+
+async def open_connections(server, count, batch):
+    sockets = []
+    for start in range(0, count, batch):
+        sockets += await asyncio.gather(*(
+            connect(server.ws_url, f"token{i}") for i in range(start, min(start + batch, count))))
+    return sockets
+
+
+async def http_latencies(server, requests):
+    latencies = []
+    async with httpx.AsyncClient(base_url=server.base_url, headers={"token": "token0"}, timeout=30) as client:
+        async def fetch(i):
+            started = time.perf_counter()
+            response = await client.get(f"/api/{user_uuid(i)}")
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        await asyncio.gather(*(fetch(i) for i in range(requests)))
+    return sorted(latencies)
+
+
+async def run(args):
+    async with Server(args.repo, users=args.connections) as server:
+        await http_latencies(server, 20)
+        rss_before = rss_kb(server.process.pid)
+        started = time.monotonic()
+        sockets = await open_connections(server, args.connections, args.batch)
+        connect_seconds = time.monotonic() - started
+        await asyncio.sleep(args.idle)
+        rss_after = rss_kb(server.process.pid)
+        latencies = await http_latencies(server, args.requests)
+        async with httpx.AsyncClient(base_url=server.base_url, headers={"token": "token0"}) as client:
+            stats = (await client.get("/api/owner/stats")).json()
+        await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+    return {
+        "label": args.label,
+        "connections": len(sockets),
+        "connect_seconds": round(connect_seconds, 2),
+        "server_connections": stats.get("sendQueues", {}).get("connections"),
+        "db_pool": stats.get("dbPool"),
+        "rss_before_mb": round(rss_before / 1024, 1),
+        "rss_after_mb": round(rss_after / 1024, 1),
+        "rss_per_connection_kb": round((rss_after - rss_before) / max(len(sockets), 1), 2),
+        "http_p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "http_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def checked_out(pool_status):
+    match = re.search(r"Checked out connections: (\d+)", pool_status or "")
+    return int(match.group(1)) if match else None
+
+
+def check(result, args):
+    failures = []
+    if result["server_connections"] != args.connections:
+        failures.append(f"server holds {result['server_connections']} of {args.connections} sockets")
+    busy = checked_out(result["db_pool"])
+    if busy is None or busy > 0:
+        failures.append(f"database pool has {busy} connection(s) checked out: {result['db_pool']}")
+    if result["rss_per_connection_kb"] > args.max_rss_per_connection_kb:
+        failures.append(f"{result['rss_per_connection_kb']} KB RSS per connection, "
+                        f"budget {args.max_rss_per_connection_kb} KB")
+    if result["http_p99_ms"] > args.max_http_p99_ms:
+        failures.append(f"HTTP p99 {result['http_p99_ms']} ms, budget {args.max_http_p99_ms} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repo", default=REPO, help="checkout to benchmark")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=250)
+    parser.add_argument("--idle", type=float, default=5, help="seconds to hold the sockets open")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--max-rss-per-connection-kb", type=float, default=120)
+    parser.add_argument("--max-http-p99-ms", type=float, default=5000)
+    parser.add_argument("--label", default="")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    print(json.dumps(result))
+    failures = check(result, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("idle connections: %d budget failure(s)" % len(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Load test with simulated Figura clients.
+
+Boots a copy of the server against a temporary SQLite database, a local
+fake Mojang session server and a locally served asset zip, then drives
+simulated clients. Each client:
+
+  * logs in through /api/auth/id and /api/auth/verify,
+  * opens /ws, authenticates, subscribes to a few other clients and pings
+    at --ping-rate,
+  * uploads its avatar, then keeps downloading other clients' avatars and
+    fetching their profiles at --http-rate.
+
+Clients can be spread over several processes with --client-procs so the
+load generator is not the bottleneck. Results are printed (and optionally
+written) as JSON; --compare prints the relative change against an earlier
+result file:
+
+    python bench/load_test.py --clients 2000 --duration 30 --client-procs 4 \\
+        --label after --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+import httpx
+import websockets
+
+from common import REPO, Server, free_port, percentile, tree_rss_kb, wait_until_up
+from fake_sessionserver import offline_uuid
+
+PING_HEADER = struct.Struct(">Bib")
+PING_PREFIX = 22  # type byte, sender uuid, ping id, sync flag
+
+
+def build_asset_zip(directory, files=200, size=4096):
+    path = os.path.join(directory, "assets.zip")
+    with zipfile.ZipFile(path, "w") as archive:
+        for i in range(files):
+            archive.writestr(f"Assets-main/v2/bench/file{i}.bin", os.urandom(size))
+    return path
+
+
+def serve_directory(directory):
+    handler = lambda *args: http.server.SimpleHTTPRequestHandler(*args, directory=directory)
+    http.server.SimpleHTTPRequestHandler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", free_port()), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Stats:
+    def __init__(self):
+        self.counts = {}
+        self.timings = {}
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def time(self, name, seconds):
+        self.timings.setdefault(name, []).append(seconds)
+
+
+async def login(client, stats, username):
+    started = time.monotonic()
+    response = await client.get("/api/auth/id", params={"username": username})
+    response.raise_for_status()
+    response = await client.get("/api/auth/verify", params={"id": response.text})
+    response.raise_for_status()
+    stats.time("auth", time.monotonic() - started)
+    return response.text
+
+
+async def http_loop(client, stats, args, token, targets, deadline):
+    headers = {"token": token}
+    avatar = os.urandom(args.avatar_size)
+    try:
+        response = await client.put("/api/avatar", content=avatar, headers=headers)
+        stats.count("upload_ok" if response.status_code == 200 else "upload_failed")
+    except httpx.HTTPError:
+        stats.count("http_errors")
+    await asyncio.sleep(random.random())
+    interval = 1 / args.http_rate if args.http_rate else None
+    while interval and time.monotonic() < deadline:
+        target = random.choice(targets)
+        for kind, path in (("profile", f"/api/{target}"), ("download", f"/api/{target}/avatar")):
+            started = time.monotonic()
+            try:
+                response = await client.get(path, headers=headers)
+                stats.time(kind, time.monotonic() - started)
+                stats.count(f"{kind}_{response.status_code}")
+            except httpx.HTTPError:
+                stats.count("http_errors")
+        await asyncio.sleep(interval)
+
+
+async def ws_loop(stats, args, ws_url, token, targets, deadline):
+    async with websockets.connect(ws_url, max_size=None, ping_interval=None) as ws:
+        await ws.send(b"\x00" + token.encode())
+        await ws.recv()
+        for target in targets:
+            await ws.send(b"\x02" + offline_uuid_bytes(target))
+        stats.count("ws_connected")
+
+        async def receive():
+            async for msg in ws:
+                if msg[0] == 1 and len(msg) >= PING_PREFIX + 8:
+                    sent_at, = struct.unpack_from(">d", msg, PING_PREFIX)
+                    stats.time("relay", time.monotonic() - sent_at)
+                    stats.count("pings_received")
+
+        receiver = asyncio.create_task(receive())
+        padding = b"\0" * max(args.ping_size - 8, 0)
+        interval = 1 / args.ping_rate if args.ping_rate else None
+        ping_id = 0
+        await asyncio.sleep(random.random() * (interval or 0))
+        while interval and time.monotonic() < deadline:
+            ping_id += 1
+            payload = struct.pack(">d", time.monotonic()) + padding
+            await ws.send(PING_HEADER.pack(1, ping_id, 0) + payload)
+            stats.count("pings_sent")
+            await asyncio.sleep(interval)
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        await asyncio.sleep(0.5)
+        receiver.cancel()
+
+
+_uuid_bytes = {}
+
+
+def offline_uuid_bytes(username):
+    value = _uuid_bytes.get(username)
+    if value is None:
+        value = _uuid_bytes[username] = offline_uuid(username).bytes
+    return value
+
+
+async def simulate(client, stats, args, base_url, index, start_at, deadline):
+    await asyncio.sleep(max(0, start_at - time.monotonic()))
+    username = f"load{index}"
+    others = [f"load{i}" for i in random.sample(range(args.clients), min(args.subs + 1, args.clients))
+              if i != index][:args.subs] or [username]
+    try:
+        token = await login(client, stats, username)
+    except httpx.HTTPError:
+        stats.count("auth_failed")
+        return
+    targets = [str(offline_uuid(name)) for name in others]
+    ws_url = base_url.replace("http://", "ws://") + "/ws"
+    results = await asyncio.gather(
+        ws_loop(stats, args, ws_url, token, others, deadline),
+        http_loop(client, stats, args, token, targets, deadline),
+        return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            stats.count("client_errors")
+
+
+async def run_clients_async(args, base_url, indexes, start, deadline):
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.http_connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(
+            simulate(client, stats, args, base_url, i,
+                     start + args.ramp * i / max(args.clients, 1), deadline)
+            for i in indexes))
+    return stats.counts, stats.timings
+
+
+def run_clients(job):
+    args, base_url, indexes, start, deadline = job
+    return asyncio.run(run_clients_async(args, base_url, indexes, start, deadline))
+
+
+def summarize(timings):
+    values = sorted(timings)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+async def sample_rss(pid, samples, stop):
+    while not stop.is_set():
+        samples.append(tree_rss_kb(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="nuovo-load-")
+    build_asset_zip(workdir)
+    static = serve_directory(workdir)
+    session_port = free_port()
+    session_server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_sessionserver.py"),
+         "--port", str(session_port), "--latency", str(args.mojang_latency)])
+    await wait_until_up(f"http://127.0.0.1:{session_port}/stats")
+    limits = {
+        "rate": {"pingSize": 1 << 20, "pingRate": 1000, "equip": 1000, "download": 1000, "upload": 1000},
+        "limits": {"maxAvatarSize": 1 << 20, "maxAvatars": 10},
+    }
+    config = {
+        "assetsUrl": f"http://127.0.0.1:{static.server_address[1]}/assets.zip",
+        "mojang": {"sessionServer": f"http://127.0.0.1:{session_port}"},
+        "defaultLimits": limits,
+    }
+    if args.workers > 1:
+        config["backplane"] = {"type": "unix", "socketPath": os.path.join(workdir, "backplane.sock")}
+    try:
+        async with Server(args.repo, users=1, config=config, workers=args.workers,
+                          local_assets=False) as server:
+            rss_samples = []
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(sample_rss(server.process.pid, rss_samples, stop))
+            start = time.monotonic() + 1
+            deadline = start + args.ramp + args.duration
+            procs = max(1, args.client_procs)
+            jobs = [(args, server.base_url, range(p, args.clients, procs), start, deadline)
+                    for p in range(procs)]
+            if procs == 1:
+                results = [await run_clients_async(*jobs[0])]
+            else:
+                with multiprocessing.get_context("spawn").Pool(procs) as pool:
+                    results = await asyncio.get_running_loop().run_in_executor(
+                        None, pool.map, run_clients, jobs)
+            stop.set()
+            await sampler
+            async with httpx.AsyncClient(base_url=server.base_url) as client:
+                owner = await client.get("/api/owner/stats", headers={"token": "token0"})
+                server_stats = owner.json() if owner.status_code == 200 else {}
+    finally:
+        session_server.terminate()
+        static.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    counts = {}
+    timings = {}
+    for part_counts, part_timings in results:
+        for name, value in part_counts.items():
+            counts[name] = counts.get(name, 0) + value
+        for name, values in part_timings.items():
+            timings.setdefault(name, []).extend(values)
+    http_requests = sum(len(timings.get(kind, ())) for kind in ("profile", "download"))
+    return {
+        "label": args.label,
+        "clients": args.clients,
+        "duration": args.duration,
+        "workers": args.workers,
+        "counts": counts,
+        "auth": summarize(timings.get("auth", [])),
+        "relay": summarize(timings.get("relay", [])),
+        "profile": summarize(timings.get("profile", [])),
+        "download": summarize(timings.get("download", [])),
+        "http_rps": round(http_requests / (args.ramp + args.duration), 1),
+        "pings_delivered_per_s": round(counts.get("pings_received", 0) / (args.ramp + args.duration), 1),
+        "rss_start_mb": round(rss_samples[0] / 1024, 1) if rss_samples else None,
+        "rss_peak_mb": round(max(rss_samples) / 1024, 1) if rss_samples else None,
+        "send_queues": server_stats.get("sendQueues"),
+    }
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}{key}.")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix[:-1], value
+
+
+def compare(previous, current):
+    before = dict(flatten(previous))
+    for key, value in flatten(current):
+        if key in before and before[key]:
+            change = (value - before[key]) / before[key] * 100
+            print(f"{key:40} {before[key]:>12} -> {value:>12}  {change:+.1f}%", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repo", default=REPO, help="checkout to benchmark")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of steady load after ramp-up")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which clients start")
+    parser.add_argument("--subs", type=int, default=5, help="other clients each client subscribes to")
+    parser.add_argument("--ping-rate", type=float, default=5, help="pings per second per client")
+    parser.add_argument("--ping-size", type=int, default=64)
+    parser.add_argument("--http-rate", type=float, default=0.5, help="profile+avatar fetches per second per client")
+    parser.add_argument("--avatar-size", type=int, default=20000)
+    parser.add_argument("--http-connections", type=int, default=200, help="HTTP pool size per client process")
+    parser.add_argument("--mojang-latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--client-procs", type=int, default=1)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="also write the JSON result here")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
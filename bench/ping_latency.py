@@ -0,0 +1,100 @@
+"""Ping relay latency under concurrent HTTP write load.
+
+Boots a copy of the server in a temporary directory, connects one pinging
+client and one subscriber over /ws, and measures how long each ping takes to
+be relayed while a set of writer clients upload avatars and hit /api/motd as
+fast as they can. Run it against two checkouts to compare them:
+
+    python bench/ping_latency.py --writers 16 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import struct
+import time
+
+import httpx
+
+from common import REPO, Server, connect, percentile, user_uuid
+
+async def writer(base_url, token, stop, counter):
+    payload = os.urandom(64 * 1024)
+    async with httpx.AsyncClient(base_url=base_url, headers={"token": token}, timeout=30) as client:
+        while not stop.is_set():
+            await client.put("/api/avatar", content=payload)
+            await client.get("/api/motd", headers={"user-agent": "Figura/0.1.5"})
+            counter[0] += 2
+
+
+async def run(args):
+    sent = {}
+    latencies = []
+    counter = [0]
+    async with Server(args.repo, users=args.writers + 2) as server:
+        sender = await connect(server.ws_url, "token0")
+        receiver = await connect(server.ws_url, "token1", [user_uuid(0)])
+        await asyncio.sleep(0.5)
+
+        async def receive():
+            async for msg in receiver:
+                if msg[0] == 1:
+                    ping_id = struct.unpack(">i", msg[17:21])[0]
+                    started = sent.pop(ping_id, None)
+                    if started is not None:
+                        latencies.append(time.perf_counter() - started)
+
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(receive())]
+        tasks += [asyncio.create_task(writer(server.base_url, f"token{i + 2}", stop, counter))
+                  for i in range(args.writers)]
+
+        interval = 1 / args.ping_rate
+        deadline = time.monotonic() + args.duration
+        ping_id = 0
+        while time.monotonic() < deadline:
+            ping_id += 1
+            sent[ping_id] = time.perf_counter()
+            await sender.send(b"\x01" + struct.pack(">ib", ping_id, 0) + b"x" * 64)
+            await asyncio.sleep(interval)
+        stop.set()
+        await asyncio.sleep(1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await sender.close()
+        await receiver.close()
+
+    latencies.sort()
+    result = {
+        "label": args.label,
+        "writers": args.writers,
+        "duration": args.duration,
+        "pings_sent": ping_id,
+        "pings_relayed": len(latencies),
+        "http_requests": counter[0],
+        "http_rps": round(counter[0] / args.duration, 1),
+    }
+    if latencies:
+        result.update({
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repo", default=REPO, help="checkout to benchmark")
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--ping-rate", type=float, default=20)
+    parser.add_argument("--label", default="")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Query-plan regression check.
+
+Builds a database the way the server does (create_all plus migrations),
+runs EXPLAIN QUERY PLAN on the hot request-path queries and fails if any
+of them falls back to a full table scan:
+
+    python bench/query_plans.py
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from common import REPO, Server
+
+# "SCAN <table>" without an index is a full scan; "SEARCH ... USING" and
+# "SCAN ... USING COVERING INDEX" are fine.
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def hot_queries():
+    from sqlalchemy import select
+    from models import Avatar, Blob, PendingVerification, Subscription, Token, User
+
+    uuids = ["00000000-0000-4000-8000-000000000000", "00000001-0000-4000-8000-000000000000"]
+    return {
+        "auth by token": select(User).join(Token, Token.user_uuid == User.uuid)
+        .where(Token.token == "token0"),
+        "token by user": select(Token).where(Token.user_uuid == uuids[0]),
+        "user by username": select(User).where(User.username == "bench0"),
+        "pending by username": select(PendingVerification)
+        .where(PendingVerification.username == "bench0"),
+        "pending by id": select(PendingVerification).where(PendingVerification.id == "x"),
+        "expired pending": select(PendingVerification.id)
+        .where(PendingVerification.created_at < "2000-01-01").limit(500),
+        "profiles": select(User).where(User.uuid.in_(uuids)),
+        "profile avatars": select(Avatar.uuid, Avatar.hash).where(Avatar.uuid.in_(uuids)),
+        "avatar hash": select(Avatar.hash).where(Avatar.uuid == uuids[0]),
+        "avatars by blob": select(Avatar.uuid).where(Avatar.hash == "ab" * 32),
+        "blob by hash": select(Blob).where(Blob.hash == "ab" * 32),
+        "subscriptions of user": select(Subscription.target_uuid)
+        .where(Subscription.user_uuid == uuids[0]),
+        "subscription pair": select(Subscription.id).where(
+            Subscription.user_uuid == uuids[0], Subscription.target_uuid == uuids[1]),
+        "newer token of user": select(Token.token).where(
+            Token.user_uuid == uuids[0], Token.created_at > "2000-01-01"),
+    }
+
+
+def check():
+    from blobstore import BlobStore
+    from database import engine
+    from migrations import upgrade
+
+    upgrade(engine, BlobStore("avatars"))
+    failures = {}
+    with engine.connect() as conn:
+        for name, statement in hot_queries().items():
+            sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            if any(FULL_SCAN.match(step) for step in plan):
+                failures[name] = plan
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repo", default=REPO, help="checkout to check")
+    parser.add_argument("--inside", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.inside:
+        sys.path.insert(0, os.getcwd())
+        print(json.dumps(check()))
+        return
+    server = Server(args.repo, users=2)
+    server.prepare()
+    try:
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--inside"],
+                                cwd=server.workdir, capture_output=True, text=True)
+        if result.returncode:
+            sys.exit(result.stderr)
+    finally:
+        shutil.rmtree(server.workdir, ignore_errors=True)
+    failures = json.loads(result.stdout.splitlines()[-1])
+    for name, plan in failures.items():
+        print(f"FULL SCAN in {name}: {plan}")
+    print("query plans: %d full scan(s)" % len(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import tempfile
+from models import Blob
+
+
+class StoreLock:
+    # Held around every commit-and-acquire and release-and-unlink. The
+    # asyncio lock orders this process's requests; the flock orders them
+    # against other workers, so one can never unlink a file another has just
+    # found in place and is about to reference.
+    def __init__(self, path: str):
+        self.path = path
+        self._local = asyncio.Lock()
+        self._fd = None
+
+    async def __aenter__(self):
+        await self._local.acquire()
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            # Polled rather than blocking in a thread, so a cancelled request
+            # cannot leave the flock taken behind it.
+            while True:
+                try:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return
+                except BlockingIOError:
+                    await asyncio.sleep(0.005)
+        except BaseException:
+            self._local.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._local.release()
+
+
+class BlobStore:
+    # Content-addressed files sharded as <root>/ab/cd/<sha256>. The blobs
+    # table counts how many avatars point at each file.
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.lock = StoreLock(os.path.join(root, ".lock"))
+
+    def path(self, blob_hash: str):
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def writer(self):
+        return BlobWriter(self)
+
+    def write(self, data: bytes):
+        writer = self.writer()
+        try:
+            writer.update(data)
+            return writer.commit()
+        finally:
+            writer.abort()
+
+    def remove(self, blob_hash: str):
+        try:
+            os.unlink(self.path(blob_hash))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def acquire(db, blob_hash: str, size: int):
+        blob = db.get(Blob, blob_hash)
+        if blob:
+            blob.refcount += 1
+        else:
+            db.add(Blob(hash=blob_hash, size=size, refcount=1))
+
+    @staticmethod
+    def release(db, blob_hash: str):
+        # Returns True when the last reference is gone and the file can be
+        # removed once the transaction has committed.
+        blob = db.get(Blob, blob_hash)
+        if not blob:
+            return False
+        blob.refcount -= 1
+        if blob.refcount > 0:
+            return False
+        db.delete(blob)
+        return True
+
+
+class BlobWriter:
+    # Streams one blob to a temporary file under the store root, hashing as
+    # it goes. commit() moves it into place under its sha256 (or drops it if
+    # that content is already stored); abort() discards it.
+    def __init__(self, store: BlobStore):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.root, prefix=".tmp-")
+        self._file = os.fdopen(fd, "wb")
+
+    def update(self, chunk: bytes):
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self._file.close()
+        blob_hash = self._hash.hexdigest()
+        path = self.store.path(blob_hash)
+        if os.path.isfile(path):
+            os.unlink(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        self._tmp_path = None
+        return blob_hash
+
+    def abort(self):
+        if self._tmp_path is None:
+            return
+        self._file.close()
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+        self._tmp_path = None
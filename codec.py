@@ -0,0 +1,106 @@
+import struct
+import uuid as uuidlib
+from functools import lru_cache
+
+# Layouts are compiled once; everything on the hot path either unpacks in
+# place from the received frame or joins prebuilt byte strings.
+PING_META = struct.Struct(">ib")
+TOAST_HEADER = struct.Struct(">bb")
+UUID_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=UUID_CACHE_SIZE)
+def uuid_to_bytes(uuid: str):
+    return uuidlib.UUID(uuid).bytes
+
+
+@lru_cache(maxsize=UUID_CACHE_SIZE)
+def uuid_from_bytes(uuid_bytes: bytes):
+    return str(uuidlib.UUID(bytes=uuid_bytes))
+
+
+class S2C:
+    AUTH = 0
+    PING = 1
+    EVENT = 2
+    TOAST = 3
+    CHAT = 4
+    NOTICE = 5
+
+    class NoticeType:
+        SIZE = 0
+        RATE = 1
+
+    class ToastType:
+        DEFAULT = 0
+        WARNING = 1
+        ERROR = 2
+        CHEESE = 3
+
+    AUTH_PACKET = bytes([AUTH])
+    NOTICE_PACKETS = {
+        NoticeType.SIZE: bytes([NOTICE, NoticeType.SIZE]),
+        NoticeType.RATE: bytes([NOTICE, NoticeType.RATE]),
+    }
+
+    @staticmethod
+    def auth():
+        return S2C.AUTH_PACKET
+
+    @staticmethod
+    def ping_header(uuid_bytes: bytes):
+        # Type byte plus sender uuid; built once per connection.
+        return bytes([S2C.PING]) + uuid_bytes
+
+    @staticmethod
+    def ping(header: bytes, ping_id: int, sync: bool, data):
+        # The result is shared by every subscriber's send queue, so the
+        # client's data is copied exactly once.
+        return b"".join((header, PING_META.pack(ping_id, sync), data))
+
+    @staticmethod
+    def event(uuid: str):
+        return bytes([S2C.EVENT]) + uuid_to_bytes(uuid)
+
+    @staticmethod
+    def toast(type: int, title: str, message: str = ""):
+        title_bytes = title.encode("utf-8")
+        message_bytes = message.encode("utf-8")
+        return TOAST_HEADER.pack(S2C.TOAST, type) + title_bytes + b"\0" + message_bytes
+
+    @staticmethod
+    def chat(message: str):
+        message_bytes = message.encode("utf-8")
+        return bytes([S2C.CHAT]) + message_bytes
+
+    @staticmethod
+    def notice(type: int):
+        return S2C.NOTICE_PACKETS.get(type) or bytes([S2C.NOTICE, type])
+
+
+class C2S:
+    TOKEN = 0
+    PING = 1
+    SUB = 2
+    UNSUB = 3
+
+    @staticmethod
+    def parse(msg: bytes):
+        # PING payloads are (id, sync, data) where data is a memoryview into
+        # msg; it stays valid as long as msg does and is never copied here.
+        if not msg:
+            return None, None
+        msg_type = msg[0]
+        if msg_type == C2S.PING:
+            if len(msg) < 6:
+                return C2S.PING, None
+            ping_id, sync = PING_META.unpack_from(msg, 1)
+            return C2S.PING, (ping_id, sync != 0, memoryview(msg)[6:])
+        elif msg_type == C2S.SUB or msg_type == C2S.UNSUB:
+            if len(msg) != 17:
+                return msg_type, None
+            return msg_type, uuid_from_bytes(msg[1:17])
+        elif msg_type == C2S.TOKEN:
+            return C2S.TOKEN, msg[1:].decode('utf-8').strip().replace("\x00", "")
+        else:
+            return msg_type, memoryview(msg)[1:]
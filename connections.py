@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import deque
+from fastapi import WebSocket
+from ratelimit import TokenBucket
+from codec import S2C, uuid_to_bytes
+
+
+class Kind:
+    CONTROL = 0
+    PING = 1
+    SYNC_PING = 2
+    EVENT = 3
+
+
+queue_stats = {
+    "sent": 0,
+    "bytesOut": 0,
+    "droppedPings": 0,
+    "coalescedEvents": 0,
+    "slowDisconnects": 0,
+}
+
+
+class ClientSession:
+    # Everything a live socket needs about its user, captured at auth time so
+    # the connection holds no database session. `limits` is an immutable
+    # UserSnapshot that is swapped wholesale when the owner reloads config.
+    __slots__ = ("uuid", "ping_header", "limits", "ping_count", "ping_bytes")
+
+    def __init__(self, limits):
+        self.uuid = limits.uuid
+        self.ping_header = S2C.ping_header(uuid_to_bytes(limits.uuid))
+        self.limits = limits
+        self.ping_count = TokenBucket()
+        self.ping_bytes = TokenBucket()
+
+
+class Connection:
+    # Fan-out only ever appends to this queue; a single writer task per
+    # socket drains it, so one slow client cannot stall anyone else.
+    def __init__(self, websocket: WebSocket, session: ClientSession,
+                 max_queue: int = 256, over_limit_seconds: float = 5):
+        self.websocket = websocket
+        self.session = session
+        self.max_queue = max_queue
+        self.over_limit_seconds = over_limit_seconds
+        self.queue = deque()
+        self.pending_events = set()
+        self.over_limit_since = None
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+        # The loop only holds tasks weakly; keep the close alive until it runs.
+        self._closer = None
+
+    def send(self, packet: bytes, kind: int = Kind.CONTROL, key=None):
+        if self.closed:
+            return False
+        if kind == Kind.EVENT:
+            if key in self.pending_events:
+                queue_stats["coalescedEvents"] += 1
+                return True
+            self.pending_events.add(key)
+        if len(self.queue) >= self.max_queue and not self._make_room(kind):
+            if kind == Kind.PING:
+                queue_stats["droppedPings"] += 1
+                return False
+            now = time.monotonic()
+            if self.over_limit_since is None:
+                self.over_limit_since = now
+            elif now - self.over_limit_since > self.over_limit_seconds or len(self.queue) >= self.max_queue * 2:
+                queue_stats["slowDisconnects"] += 1
+                self.disconnect(1008, "Send queue overflow")
+                return False
+        self.queue.append((packet, kind, key))
+        self._ready.set()
+        return True
+
+    def _make_room(self, kind: int):
+        # Unsynced pings are superseded by the next one anyway, so they are
+        # the first thing to go when a client falls behind.
+        if kind == Kind.PING:
+            return False
+        for i, (_, queued_kind, _) in enumerate(self.queue):
+            if queued_kind == Kind.PING:
+                del self.queue[i]
+                queue_stats["droppedPings"] += 1
+                return True
+        return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                packet, kind, key = self.queue.popleft()
+                if kind == Kind.EVENT:
+                    self.pending_events.discard(key)
+                await self.websocket.send_bytes(packet)
+                queue_stats["sent"] += 1
+                queue_stats["bytesOut"] += len(packet)
+                if self.over_limit_since is not None and len(self.queue) < self.max_queue:
+                    self.over_limit_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+            self.queue.clear()
+
+    def disconnect(self, code: int, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._writer.cancel()
+        self._closer = asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def stop(self):
+        self.closed = True
+        self.queue.clear()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+
+
+def queue_metrics(connections):
+    depths = [len(conn.queue) for conn in connections]
+    return {
+        **queue_stats,
+        "connections": len(depths),
+        "queued": sum(depths),
+        "maxDepth": max(depths, default=0),
+    }
@@ -1,8 +1,68 @@
-from sqlalchemy import create_engine
+import asyncio
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlalchemy import create_engine, event, make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./figura.db"
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    CONFIG = json.load(f)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = os.environ.get(
+    "DATABASE_URL", CONFIG.get("databaseUrl", "sqlite:///./figura.db"))
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+SQLITE_PRAGMAS.update(CONFIG.get("sqlitePragmas", {}))
+
+# Sessions are used from the executor threads, which sqlite3 refuses by
+# default; other drivers reject the option.
+connect_args = {}
+if make_url(DATABASE_URL).get_backend_name() == "sqlite":
+    connect_args["check_same_thread"] = False
+
+engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+# All ORM work from async handlers runs here so queries and commits never
+# block the event loop. SQLite allows a single writer, so a small pool is
+# enough; busy_timeout makes the others wait instead of failing.
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=CONFIG.get("dbWorkers", 4), thread_name_prefix="db")
+
+
+def with_session(func, *args):
+    db = SessionLocal()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+async def run_db(func, *args):
+    # Run in a copy of the caller's context so per-request instrumentation
+    # can follow the work onto the executor thread.
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        DB_EXECUTOR, partial(context.run, with_session, func, *args))
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class EventDebouncer:
+    # Holds avatar-change EVENTs per uuid for `window` seconds after the
+    # first change. Further uploads or deletes inside the window are folded
+    # into that one EVENT, so a user re-uploading in a loop costs watchers
+    # one fan-out and one re-download per window instead of one per upload.
+    # A window of 0 publishes immediately.
+    def __init__(self, window: float = 1):
+        self.window = window
+        self.pending = {}
+        self.changes = 0
+        self.published = 0
+        self.collapsed = 0
+        # Called with the uuid once its window closes.
+        self.on_publish = None
+
+    def configure(self, window: float):
+        self.window = window
+
+    def changed(self, user_uuid: str):
+        self.changes += 1
+        if user_uuid in self.pending:
+            self.collapsed += 1
+            return
+        if self.window <= 0:
+            self._publish(user_uuid)
+            return
+        self.pending[user_uuid] = asyncio.get_running_loop().call_later(
+            self.window, self._fire, user_uuid)
+
+    def _fire(self, user_uuid: str):
+        self.pending.pop(user_uuid, None)
+        self._publish(user_uuid)
+
+    def _publish(self, user_uuid: str):
+        self.published += 1
+        try:
+            self.on_publish(user_uuid)
+        except Exception:
+            logger.exception("Failed to publish avatar event for %s", user_uuid)
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        for user_uuid, handle in pending.items():
+            handle.cancel()
+            self._publish(user_uuid)
+
+    def stats(self):
+        return {
+            "window": self.window,
+            "pending": len(self.pending),
+            "changes": self.changes,
+            "published": self.published,
+            "collapsed": self.collapsed,
+        }
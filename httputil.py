@@ -0,0 +1,49 @@
+from fastapi import Request
+
+
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def accepted_encodings(header: str):
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def parse_range(header: str, length: int):
+    # Only single byte ranges are supported; anything else is served whole.
+    # Returns (start, end) inclusive, None to ignore the header, or False
+    # when the range cannot be satisfied.
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return False
+            return max(length - suffix, 0), length - 1
+        start = int(start)
+        end = int(end) if end else length - 1
+    except ValueError:
+        return None
+    if start >= length or end < start:
+        return False
+    return start, min(end, length - 1)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import exists, select, text
+from sqlalchemy.orm import aliased
+from database import engine, run_db
+from models import PendingVerification, Subscription, Token, User
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def delete_batch(db, model, key, condition, limit: int):
+    doomed = select(key).where(condition).limit(limit)
+    deleted = db.query(model).filter(key.in_(doomed)).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def expire_pending_verifications(ttl: float):
+    def job(db, limit):
+        cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+        return delete_batch(db, PendingVerification, PendingVerification.id,
+                            PendingVerification.created_at < cutoff, limit)
+    return job
+
+
+def prune_orphan_subscriptions(db, limit):
+    return delete_batch(db, Subscription, Subscription.id,
+                        ~exists().where(User.uuid == Subscription.user_uuid), limit)
+
+
+def prune_orphan_tokens(db, limit):
+    return delete_batch(db, Token, Token.token,
+                        ~exists().where(User.uuid == Token.user_uuid), limit)
+
+
+def prune_superseded_tokens(db, limit):
+    # Logging in replaces a user's token; older ones (left behind by racing
+    # logins or by versions that only replaced one) are dead weight.
+    newer = aliased(Token)
+    return delete_batch(db, Token, Token.token,
+                        exists().where(newer.user_uuid == Token.user_uuid,
+                                       newer.created_at > Token.created_at), limit)
+
+
+def run_script(db, script: str):
+    # The sqlite3 module steps a statement only once, which for
+    # incremental_vacuum frees a single page; executescript runs to the end.
+    db.commit()
+    db.connection().connection.dbapi_connection.executescript(script)
+
+
+def incremental_vacuum(pages: int):
+    # Needs auto_vacuum=INCREMENTAL, which the migrations switch on.
+    def job(db, limit):
+        before = db.execute(text("PRAGMA freelist_count")).scalar()
+        run_script(db, f"PRAGMA incremental_vacuum({pages});")
+        return before - db.execute(text("PRAGMA freelist_count")).scalar()
+    return job
+
+
+def optimize(db, limit):
+    # PRAGMA optimize only re-ANALYZEs tables whose statistics look stale,
+    # and analysis_limit caps how many rows each index scan may sample.
+    run_script(db, "PRAGMA analysis_limit=400; PRAGMA optimize;")
+    return 0
+
+
+class Job:
+    def __init__(self, name: str, func, interval: float, sliced: bool):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.sliced = sliced
+        self.next_run = time.monotonic() + interval
+        self.runs = 0
+        self.rows = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_seconds = 0.0
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "rows": self.rows,
+            "errors": self.errors,
+            "lastRun": self.last_run,
+            "lastSeconds": round(self.last_seconds, 4),
+        }
+
+
+class MaintenanceScheduler:
+    # Runs housekeeping jobs on the database executor. A sliced job deletes
+    # at most `batch_size` rows per transaction and keeps going only while
+    # it has used less than `slice_seconds`, yielding between batches, so
+    # request queries never queue behind a long write.
+    def __init__(self, batch_size: int = 500, slice_seconds: float = 0.5):
+        self.batch_size = batch_size
+        self.slice_seconds = slice_seconds
+        self.jobs = []
+        self._stop = asyncio.Event()
+        self._task = None
+
+    def add(self, name: str, func, interval: float, sliced: bool = True):
+        self.jobs.append(Job(name, func, interval, sliced))
+
+    async def run_job(self, job: Job):
+        started = time.monotonic()
+        try:
+            while True:
+                done = await run_db(job.func, self.batch_size)
+                job.rows += done
+                if not job.sliced or done < self.batch_size:
+                    break
+                if time.monotonic() - started > self.slice_seconds:
+                    break
+                await asyncio.sleep(0)
+        except Exception:
+            job.errors += 1
+            logger.exception("Maintenance job %s failed", job.name)
+        job.runs += 1
+        job.last_run = datetime.utcnow().isoformat() + "Z"
+        job.last_seconds = time.monotonic() - started
+        job.next_run = time.monotonic() + job.interval
+
+    def start(self):
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job in self.jobs:
+                if job.next_run <= now and not self._stop.is_set():
+                    await self.run_job(job)
+            delay = min((job.next_run for job in self.jobs), default=now + 60) - time.monotonic()
+            try:
+                await asyncio.wait_for(self._stop.wait(), max(delay, 1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    def stats(self):
+        return {job.name: job.stats() for job in self.jobs}
+
+
+def create_maintenance(settings: dict):
+    scheduler = MaintenanceScheduler(settings.get("batchSize", 500),
+                                     settings.get("sliceSeconds", 0.5))
+    interval = settings.get("interval", 300)
+    scheduler.add("expirePendingVerifications",
+                  expire_pending_verifications(settings.get("pendingVerificationTtl", 600)),
+                  interval)
+    scheduler.add("pruneOrphanSubscriptions", prune_orphan_subscriptions, interval)
+    scheduler.add("pruneOrphanTokens", prune_orphan_tokens, interval)
+    scheduler.add("pruneSupersededTokens", prune_superseded_tokens, interval)
+    if engine.dialect.name == "sqlite":
+        scheduler.add("incrementalVacuum", incremental_vacuum(settings.get("vacuumPages", 256)),
+                      settings.get("vacuumInterval", 3600), sliced=False)
+        scheduler.add("optimize", optimize, settings.get("analyzeInterval", 3600), sliced=False)
+    return scheduler
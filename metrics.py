@@ -0,0 +1,171 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+
+# Plain counters and fixed-bucket histograms rendered in the Prometheus text
+# format. Recording is a dict lookup and a bisect under an uncontended lock,
+# cheap enough to leave on for every request.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, labels=()):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = (*self.labelnames, "le")
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{format_labels(names, (*labels, bound))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {count}"
+
+
+class Collected:
+    # Values read from existing stats at scrape time; `collect` returns a
+    # number or a {label values: number} dict.
+    def __init__(self, name: str, help: str, kind: str, collect, labelnames=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.collect = collect
+        self.labelnames = labelnames
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def collected(self, *args, **kwargs):
+        return self.register(Collected(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_seconds = registry.histogram(
+    "nuovo_http_request_seconds", "Time to produce a response, by route.", ("method", "route"))
+http_responses = registry.counter(
+    "nuovo_http_responses_total", "Responses by route and status code.", ("method", "route", "status"))
+db_queries_per_request = registry.histogram(
+    "nuovo_http_db_queries", "Database queries issued per request, by route.", ("route",), COUNT_BUCKETS)
+db_seconds_per_request = registry.histogram(
+    "nuovo_http_db_seconds", "Database time spent per request, by route.", ("route",))
+db_queries = registry.counter("nuovo_db_queries_total", "Database statements executed.")
+db_query_seconds = registry.histogram("nuovo_db_query_seconds", "Time per database statement.")
+ws_pings = registry.counter("nuovo_ws_pings_relayed_total", "Pings accepted from clients and relayed.")
+ws_fanout = registry.histogram(
+    "nuovo_ws_ping_fanout", "Local connections each relayed ping was queued to.", buckets=COUNT_BUCKETS)
+ws_notices = registry.counter("nuovo_ws_notices_total", "Rate and size notices sent.", ("type",))
+served_bytes = registry.counter("nuovo_served_bytes_total", "Response bytes for assets and avatars.", ("kind",))
+
+# Per-request database usage, [queries, seconds], set by TimingMiddleware.
+# run_db copies the context into the executor thread, so the engine hooks
+# below can find it.
+request_db = ContextVar("request_db", default=None)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float, usage):
+    http_seconds.observe(seconds, (method, route))
+    http_responses.inc(1, (method, route, status))
+    db_queries_per_request.observe(usage[0], (route,))
+    db_seconds_per_request.observe(usage[1], (route,))
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+        db_queries.inc()
+        db_query_seconds.observe(elapsed)
+        usage = request_db.get()
+        if usage is not None:
+            usage[0] += 1
+            usage[1] += elapsed
+
+
+def record_served(kind: str, response):
+    body = getattr(response, "body", None)
+    if body is not None:
+        served_bytes.inc(len(body), (kind,))
+    elif getattr(response, "stat_result", None) is not None:
+        served_bytes.inc(response.stat_result.st_size, (kind,))
+    return response
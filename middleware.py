@@ -0,0 +1,72 @@
+import time
+import metrics
+
+# Plain ASGI middleware. Unlike @app.middleware("http") these don't wrap
+# each request in an extra task and body stream; they touch the scope and
+# pass messages straight through. main.py stacks them outermost first.
+
+
+class NormalizePathMiddleware:
+    # Collapses repeated slashes and drops a trailing one. Almost every path
+    # needs neither, which two string checks settle without a split.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            if "//" in path or (path.endswith("/") and path != "/"):
+                scope["path"] = "/" + "/".join(filter(None, path.split("/")))
+        await self.app(scope, receive, send)
+
+
+class TimingMiddleware:
+    # Records latency (up to the response headers), status and database
+    # usage per matched route. The router leaves the matched route in the
+    # scope, so unmatched paths share a single label.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        usage = [0, 0.0]
+        status = 500
+        elapsed = None
+
+        async def timed_send(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - started
+            await send(message)
+
+        context = metrics.request_db.set(usage)
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            metrics.request_db.reset(context)
+            route = scope.get("route")
+            metrics.observe_request(scope["method"], getattr(route, "path", "<unmatched>"), status,
+                                    elapsed if elapsed is not None else time.perf_counter() - started,
+                                    usage)
+
+
+class TokenMiddleware:
+    # Pulls the token header out of the raw headers once and leaves it in
+    # scope["token"] for request_user, instead of every handler building a
+    # Headers object to look it up.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            token = None
+            for name, value in scope["headers"]:
+                if name == b"token":
+                    token = value.decode("latin-1")
+                    break
+            scope["token"] = token
+        await self.app(scope, receive, send)
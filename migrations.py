@@ -0,0 +1,197 @@
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+from functools import partial
+import badges
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def lock_path(engine):
+    database = engine.url.database
+    if engine.dialect.name == "sqlite" and database and database != ":memory:":
+        return database + ".migrate.lock"
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), ".migrate.lock")
+
+
+@contextmanager
+def migration_lock(engine):
+    # Every uvicorn worker migrates at import. An flock makes them take turns
+    # so each one sees the schema version the previous one left behind; the
+    # kernel releases it if the holder dies.
+    fd = os.open(lock_path(engine), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def upgrade(engine, blob_store):
+    # Steps run in order and the schema version is bumped after each one,
+    # so a database only ever runs the steps it has not seen. Append new
+    # steps to the end; never reorder or remove them. Every step is also
+    # safe to re-run, since databases from before versioning start at 0.
+    steps = [
+        partial(add_avatar_hashes, engine),
+        partial(move_avatars_to_blob_store, engine, blob_store),
+        partial(convert_badges_to_masks, engine),
+        partial(add_pending_created_at, engine),
+        partial(enable_incremental_vacuum, engine),
+        partial(add_lookup_indexes, engine),
+        partial(add_token_created_at, engine),
+    ]
+    version = schema_version(engine)
+    for number, step in enumerate(steps[version:], version + 1):
+        logger.info("Applying schema migration %d: %s", number, step.func.__name__)
+        step()
+        set_schema_version(engine, number)
+
+
+def schema_version(engine):
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            return conn.execute(text("PRAGMA user_version")).scalar()
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        conn.commit()
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def set_schema_version(engine, version: int):
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+        else:
+            conn.execute(text("DELETE FROM schema_version"))
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"),
+                         {"version": version})
+
+
+def table_columns(engine, table):
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def avatar_columns(engine):
+    return table_columns(engine, "avatars")
+
+
+def add_avatar_hashes(engine):
+    # Only adds the columns. Rows still holding inline data get their hash
+    # and size from move_avatars_to_blob_store, one row at a time.
+    columns = avatar_columns(engine)
+    with engine.begin() as conn:
+        if "hash" not in columns:
+            conn.execute(text("ALTER TABLE avatars ADD COLUMN hash VARCHAR(64)"))
+        if "size" not in columns:
+            conn.execute(text("ALTER TABLE avatars ADD COLUMN size INTEGER"))
+
+
+def move_avatars_to_blob_store(engine, blob_store):
+    # Avatars used to live in avatars.data. Copy each one into the blob store,
+    # one row per transaction, and only then drop the column.
+    if "data" not in avatar_columns(engine):
+        return
+    with engine.connect() as conn:
+        uuids = [row[0] for row in conn.execute(text(
+            "SELECT uuid FROM avatars WHERE data IS NOT NULL")).fetchall()]
+    for uuid in uuids:
+        with engine.begin() as conn:
+            data = conn.execute(text("SELECT data FROM avatars WHERE uuid = :uuid"),
+                                {"uuid": uuid}).scalar()
+            if data is None:
+                continue
+            blob_hash = blob_store.write(data)
+            conn.execute(text(
+                "INSERT INTO blobs (hash, size, refcount) VALUES (:hash, :size, 1) "
+                "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1"),
+                {"hash": blob_hash, "size": len(data)})
+            conn.execute(text(
+                "UPDATE avatars SET hash = :hash, size = :size, data = NULL WHERE uuid = :uuid"),
+                {"hash": blob_hash, "size": len(data), "uuid": uuid})
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE avatars DROP COLUMN data"))
+    except OperationalError:
+        # SQLite before 3.35 cannot drop columns; the emptied column is harmless.
+        pass
+
+
+BADGE_COLUMNS = ("special_badges", "pride_badges", "equipped_special_badges", "equipped_pride_badges")
+
+
+def convert_badges_to_masks(engine):
+    # Badges used to be comma-joined 0/1 strings. Move each into its *_mask
+    # integer column, clearing the string so a rerun never overwrites a
+    # newer mask, then drop the string columns.
+    columns = table_columns(engine, "users")
+    legacy = [name for name in BADGE_COLUMNS if name in columns]
+    with engine.begin() as conn:
+        for name in BADGE_COLUMNS:
+            if name + "_mask" not in columns:
+                conn.execute(text(f"ALTER TABLE users ADD COLUMN {name}_mask INTEGER DEFAULT 0"))
+        for name in legacy:
+            rows = conn.execute(text(
+                f"SELECT uuid, {name} FROM users WHERE {name} IS NOT NULL")).fetchall()
+            for uuid, value in rows:
+                conn.execute(text(
+                    f"UPDATE users SET {name}_mask = :mask, {name} = NULL WHERE uuid = :uuid"),
+                    {"mask": badges.parse(value), "uuid": uuid})
+    for name in legacy:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE users DROP COLUMN {name}"))
+        except OperationalError:
+            # SQLite before 3.35 cannot drop columns; the emptied column is harmless.
+            pass
+
+
+def add_pending_created_at(engine):
+    # Rows from before the column existed start their expiry clock now.
+    if "created_at" in table_columns(engine, "pending_verifications"):
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE pending_verifications ADD COLUMN created_at DATETIME"))
+        conn.execute(text("UPDATE pending_verifications SET created_at = CURRENT_TIMESTAMP"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_pending_verifications_created_at "
+            "ON pending_verifications (created_at)"))
+
+
+def enable_incremental_vacuum(engine):
+    # auto_vacuum only takes effect after a full VACUUM, so this rebuilds the
+    # file once; afterwards maintenance frees pages a slice at a time.
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+
+
+def add_lookup_indexes(engine):
+    # Collapse duplicate subscriptions left by the old read-then-insert SUB
+    # before the pair becomes unique.
+    with engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM subscriptions WHERE id NOT IN ("
+            "SELECT MIN(id) FROM subscriptions GROUP BY user_uuid, target_uuid)"))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_subscriptions_user_target "
+            "ON subscriptions (user_uuid, target_uuid)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tokens_user_uuid ON tokens (user_uuid)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_avatars_hash ON avatars (hash)"))
+
+
+def add_token_created_at(engine):
+    # Existing tokens all get the same time, so none of them counts as
+    # superseded until its user logs in again.
+    if "created_at" in table_columns(engine, "tokens"):
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE tokens ADD COLUMN created_at DATETIME"))
+        conn.execute(text("UPDATE tokens SET created_at = CURRENT_TIMESTAMP"))
@@ -1,8 +1,9 @@
 import json
 import os
-from sqlalchemy import Column, String, LargeBinary, DateTime, Integer, ForeignKey
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
+import badges
 import datetime
 
 # Load config.json at import time for default values
@@ -13,15 +14,16 @@ default_limits = CONFIG.get("defaultLimits", {})
 default_rate = default_limits.get("rate", {})
 default_limits_section = default_limits.get("limits", {})
 default_special_badges = default_limits_section.get(
-    "allowedBadges", {}).get("special", [0, 0, 0, 0, 0, 0])
+    "allowedBadges", {}).get("special", [0] * badges.SPECIAL_COUNT)
 default_pride_badges = default_limits_section.get(
-    "allowedBadges", {}).get("pride", [0]*25)
+    "allowedBadges", {}).get("pride", [0] * badges.PRIDE_COUNT)
 
 
 class PendingVerification(Base):
     __tablename__ = "pending_verifications"
     id = Column(String, primary_key=True, index=True)
     username = Column(String, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
 
 
 class User(Base):
@@ -37,14 +39,10 @@ class User(Base):
         Integer, default=default_limits_section.get("maxAvatarSize", 100000))
     max_avatars = Column(
         Integer, default=default_limits_section.get("maxAvatars", 10))
-    special_badges = Column(String, default=",".join(str(x)
-                            for x in default_special_badges))
-    pride_badges = Column(String, default=",".join(str(x)
-                          for x in default_pride_badges))
-    equipped_special_badges = Column(
-        String, default=",".join("0" for _ in default_special_badges))
-    equipped_pride_badges = Column(
-        String, default=",".join("0" for _ in default_pride_badges))
+    special_badges_mask = Column(Integer, default=badges.pack(default_special_badges))
+    pride_badges_mask = Column(Integer, default=badges.pack(default_pride_badges))
+    equipped_special_badges_mask = Column(Integer, default=0)
+    equipped_pride_badges_mask = Column(Integer, default=0)
     tokens = relationship("Token", back_populates="user")
     last_used = Column(DateTime, nullable=True)
     version = Column(String, nullable=True)
@@ -53,19 +51,32 @@ class User(Base):
 class Token(Base):
     __tablename__ = "tokens"
     token = Column(String, primary_key=True, index=True)
-    user_uuid = Column(String, ForeignKey("users.uuid"))
+    user_uuid = Column(String, ForeignKey("users.uuid"), index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
     user = relationship("User", back_populates="tokens")
 
 
 class Avatar(Base):
     __tablename__ = "avatars"
     uuid = Column(String, primary_key=True, index=True)
-    data = Column(LargeBinary)
+    hash = Column(String(64), ForeignKey("blobs.hash"), nullable=True, index=True)
+    size = Column(Integer, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 
+class Blob(Base):
+    __tablename__ = "blobs"
+    hash = Column(String(64), primary_key=True)
+    size = Column(Integer)
+    refcount = Column(Integer, default=0)
+
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_uuid = Column(String, ForeignKey("users.uuid"), index=True)
     target_uuid = Column(String, index=True)  # UUID the user is subscribed to
+
+    __table_args__ = (
+        Index("ux_subscriptions_user_target", "user_uuid", "target_uuid", unique=True),
+    )
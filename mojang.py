@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import uuid as uuidlib
+import httpx
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger("uvicorn.error")
+
+DEFAULT_SESSION_SERVER = "https://sessionserver.mojang.com"
+
+
+class SessionServerUnavailable(Exception):
+    pass
+
+
+class SessionVerifier:
+    # One pooled keep-alive client for every hasJoined check, so logins
+    # reuse TLS connections instead of handshaking each time. Concurrent
+    # verifications of the same server id share a single request, and at
+    # most `concurrency` requests are in flight at once.
+    def __init__(self, base_url: str = DEFAULT_SESSION_SERVER, timeout: float = 5,
+                 retries: int = 2, backoff: float = 0.25, concurrency: int = 16,
+                 http2: bool = True):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.http2 = http2 and h2 is not None
+        self.requests = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failures = 0
+        self._client = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight = {}
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.concurrency,
+                                    max_keepalive_connections=self.concurrency))
+        return self._client
+
+    async def verify(self, username: str, server_id: str):
+        # Returns the player's dashed uuid, or None if Mojang says they have
+        # not joined. Raises SessionServerUnavailable once retries run out.
+        task = self._inflight.get(server_id)
+        if task is None:
+            task = asyncio.create_task(self._verify(username, server_id))
+            self._inflight[server_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(server_id, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _verify(self, username: str, server_id: str):
+        params = {"username": username, "serverId": server_id}
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.retried += 1
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+                self.requests += 1
+                try:
+                    response = await self._get_client().get(
+                        "/session/minecraft/hasJoined", params=params)
+                except httpx.TransportError as e:
+                    logger.warning("Session server request failed: %r", e)
+                    continue
+                if response.status_code == 429 or response.status_code >= 500:
+                    continue
+                if response.status_code != 200:
+                    return None
+                try:
+                    return str(uuidlib.UUID(response.json().get("id")))
+                except (ValueError, TypeError, AttributeError):
+                    return None
+        self.failures += 1
+        raise SessionServerUnavailable(self.base_url)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {
+            "baseUrl": self.base_url,
+            "http2": self.http2,
+            "inFlight": len(self._inflight),
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "failures": self.failures,
+        }
+
+
+def create_verifier(settings: dict):
+    return SessionVerifier(
+        base_url=settings.get("sessionServer", DEFAULT_SESSION_SERVER),
+        timeout=settings.get("timeout", 5),
+        retries=settings.get("retries", 2),
+        backoff=settings.get("backoff", 0.25),
+        concurrency=settings.get("concurrency", 16),
+        http2=settings.get("http2", True),
+    )
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import random
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class MotdProvider:
+    # The combined list of configured and motdsDir messages is built once. A
+    # background task rescans the directory every `interval` seconds and
+    # only re-reads files when a name, size or mtime has changed.
+    def __init__(self, messages, directory: str, interval: float = 5):
+        self.messages = list(messages)
+        self.directory = directory
+        self.interval = interval
+        self.motds = []
+        self.signature = None
+        self.reloads = 0
+        self._task = None
+
+    def configure(self, messages, directory: str, interval: float = 5):
+        self.messages = list(messages)
+        self.directory = directory
+        self.interval = interval
+
+    def scan(self):
+        if not os.path.isdir(self.directory):
+            return ()
+        signature = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(signature))
+
+    def refresh(self, force: bool = False):
+        signature = self.scan()
+        if not force and signature == self.signature:
+            return False
+        motds = self.messages.copy()
+        for name, _, _ in signature:
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    motds.append(f.read().strip())
+            except (OSError, UnicodeDecodeError):
+                logger.warning("Could not read MOTD file %s", name)
+        self.motds = motds or ["No MOTDs configured"]
+        self.signature = signature
+        self.reloads += 1
+        return True
+
+    def choice(self):
+        return random.choice(self.motds)
+
+    def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception:
+                logger.exception("Failed to refresh MOTDs")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "count": len(self.motds),
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProfileCache:
+    # uuid -> (expires_at, body, etag), least recently used first. Bodies are
+    # the exact JSON bytes served by /api/{uuid}. Loads note the generation
+    # before reading, and a put() is dropped if that uuid was invalidated (or
+    # the cache cleared) since, so a slow read can never reinstate a profile
+    # that was just changed. Invalidating one uuid leaves loads of the others
+    # alone.
+    def __init__(self, ttl: float = 300, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.generation = 0
+        # generation of the last clear(), and of each uuid's last invalidation
+        self._epoch = 0
+        self._invalidated = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uuid: str):
+        with self._lock:
+            entry = self._entries.get(uuid)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, body, etag = entry
+            if expires_at < time.monotonic():
+                del self._entries[uuid]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(uuid)
+            self.hits += 1
+            return body, etag
+
+    def put(self, uuid: str, body: bytes, etag: str, generation: int):
+        with self._lock:
+            if generation < self._epoch or self._invalidated.get(uuid, 0) > generation:
+                return
+            self._entries[uuid] = (time.monotonic() + self.ttl, body, etag)
+            self._entries.move_to_end(uuid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, uuid: str):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(uuid, None)
+            self._invalidated[uuid] = self.generation
+            if len(self._invalidated) > self.max_size:
+                # Forget the per-uuid marks; the epoch covers them all.
+                self._epoch = self.generation
+                self._invalidated.clear()
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._epoch = self.generation
+            self._invalidated.clear()
+            self._entries.clear()
+
+    def configure(self, ttl: float, max_size: int):
+        with self._lock:
+            self.ttl = ttl
+            self.max_size = max_size
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# On-demand diagnostics for the owner endpoints. Nothing here runs, hooks
+# the interpreter or holds memory until an owner asks for it, and each
+# tool switches itself off again afterwards.
+
+
+def describe_frame(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def fold_stack(frame):
+    # Root first, the order flamegraph.pl and speedscope expect.
+    names = []
+    while frame is not None:
+        names.append(describe_frame(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    # A thread wakes every `interval` seconds, reads every other thread's
+    # current stack and counts identical stacks. The result is the "folded"
+    # format: one "root;...;leaf count" line per distinct stack.
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def sample(self, seconds: float, interval: float):
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            counts = collections.Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        thread = names.get(ident, str(ident)).replace(";", ":").replace(" ", "_")
+                        counts[thread + ";" + fold_stack(frame)] += 1
+                time.sleep(interval)
+            return counts
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def render(counts):
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class MemoryTracer:
+    # Wraps tracemalloc, which slows every allocation while it is on, so it
+    # only runs between start() and stop(). Each snapshot is diffed against
+    # the previous one to show what grew.
+    def __init__(self):
+        self.previous = None
+        self.started = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(frames)
+        self.previous = None
+        self.started = time.time()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
+        self.started = None
+
+    @staticmethod
+    def describe(stat):
+        return {
+            "where": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            "sizeKb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+
+    def snapshot(self, limit: int = 25, group_by: str = "lineno"):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "tracedKb": round(current / 1024, 1),
+            "peakKb": round(peak / 1024, 1),
+            "top": [self.describe(stat) for stat in snapshot.statistics(group_by)[:limit]],
+        }
+        if self.previous is not None:
+            result["diff"] = [
+                dict(self.describe(stat), sizeDiffKb=round(stat.size_diff / 1024, 1),
+                     countDiff=stat.count_diff)
+                for stat in snapshot.compare_to(self.previous, group_by)[:limit]
+            ]
+        self.previous = snapshot
+        return result
+
+
+class LoopMonitor:
+    # A heartbeat task on the event loop records how late each wake-up is.
+    # A watchdog thread checks the heartbeat; when the loop has not beaten
+    # for `threshold` seconds it grabs the loop thread's stack, which names
+    # the callback that is blocking it. Stops itself after `seconds`.
+    def __init__(self, interval: float = 0.01, keep: int = 20):
+        self.interval = interval
+        self.keep = keep
+        self.threshold = 0.1
+        self.lags = collections.deque(maxlen=100000)
+        self.stalls = []
+        self.started = None
+        self.until = None
+        self._heartbeat = 0.0
+        self._loop_thread = None
+        self._task = None
+        self._timer = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self, seconds: float, threshold: float):
+        if self.running:
+            self.stop()
+        self.threshold = threshold
+        self.lags.clear()
+        self.stalls = []
+        self.started = time.time()
+        self.until = self.started + seconds
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lags.append(now - expected)
+            self._heartbeat = now
+
+    def _watch(self):
+        beat = None
+        stack = None
+        while not self._stop.wait(self.interval):
+            current = self._heartbeat
+            if current != beat:
+                if stack is not None:
+                    self._record(stack, time.monotonic() - beat)
+                beat = current
+                stack = None
+            elif stack is None and time.monotonic() - beat > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = fold_stack(frame) if frame is not None else "<unknown>"
+        if stack is not None:
+            self._record(stack, time.monotonic() - beat)
+
+    def _record(self, stack: str, seconds: float):
+        stalls = self.stalls + [{"seconds": round(seconds, 4), "stack": stack,
+                                 "at": round(time.time() - seconds, 3)}]
+        stalls.sort(key=lambda stall: stall["seconds"], reverse=True)
+        self.stalls = stalls[:self.keep]
+
+    def stats(self):
+        lags = sorted(self.lags)
+
+        def percentile(fraction):
+            return round(lags[min(int(len(lags) * fraction), len(lags) - 1)] * 1000, 2) if lags else None
+
+        return {
+            "running": self.running,
+            "started": self.started,
+            "until": self.until,
+            "thresholdMs": self.threshold * 1000,
+            "samples": len(lags),
+            "lagMs": {"p50": percentile(0.5), "p99": percentile(0.99), "max": percentile(1)},
+            "longestStalls": self.stalls,
+        }
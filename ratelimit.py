@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    # Refills continuously at `rate` per second up to `burst`, so there is
+    # no window edge to burst across. A new bucket starts full.
+    __slots__ = ("level", "updated")
+
+    def __init__(self):
+        self.level = None
+        self.updated = 0.0
+
+    def tokens(self, rate: float, burst: float, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        if self.level is None:
+            self.level = burst
+        else:
+            self.level = min(burst, self.level + (now - self.updated) * rate)
+        self.updated = now
+        return self.level
+
+    def take(self, cost: float = 1):
+        self.level -= cost
+
+
+class RateLimiter:
+    # Token buckets keyed by (uuid, limit name), kept in last-touched order
+    # so idle entries can be evicted from the front without scanning.
+    def __init__(self, idle_seconds: float = 300):
+        self.idle_seconds = idle_seconds
+        self.limited = 0
+        self._buckets = OrderedDict()
+
+    def allow(self, key, rate: float, burst: float = None, cost: float = 1):
+        if burst is None:
+            burst = max(rate, cost)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket()
+        else:
+            self._buckets.move_to_end(key)
+        level = bucket.tokens(rate, burst, now)
+        self._evict(now)
+        if level < cost:
+            self.limited += 1
+            return False
+        bucket.take(cost)
+        return True
+
+    def _evict(self, now: float):
+        cutoff = now - self.idle_seconds
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.updated >= cutoff:
+                break
+            del self._buckets[key]
+
+    def stats(self):
+        return {
+            "buckets": len(self._buckets),
+            "limited": self.limited,
+        }
@@ -0,0 +1,104 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlalchemy.dialects import postgresql, sqlite
+from database import engine, run_db, with_session
+from models import Subscription
+
+insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+
+
+class SubscriptionIndex:
+    # target uuid -> uuids of connected subscribers, plus the reverse mapping
+    # so a disconnecting user can be dropped without scanning every target.
+    def __init__(self):
+        self.targets = {}
+        self.subscribed = defaultdict(set)
+        # Called with (target_uuid, True) when a target gains its first
+        # subscriber and (target_uuid, False) when it loses its last one.
+        self.watcher = None
+        self._pending = set()
+        # A single writer keeps SUB/UNSUB persistence in arrival order.
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+    def subscribers(self, target_uuid: str):
+        return self.targets.get(target_uuid, ())
+
+    def add(self, user_uuid: str, target_uuid: str):
+        if target_uuid in self.subscribed[user_uuid]:
+            return False
+        self.subscribed[user_uuid].add(target_uuid)
+        subs = self.targets.get(target_uuid)
+        if subs is None:
+            subs = self.targets[target_uuid] = set()
+            if self.watcher:
+                self.watcher(target_uuid, True)
+        subs.add(user_uuid)
+        return True
+
+    def remove(self, user_uuid: str, target_uuid: str):
+        targets = self.subscribed.get(user_uuid)
+        if not targets or target_uuid not in targets:
+            return False
+        targets.discard(target_uuid)
+        if not targets:
+            del self.subscribed[user_uuid]
+        self._discard(user_uuid, target_uuid)
+        return True
+
+    def drop_user(self, user_uuid: str):
+        for target_uuid in self.subscribed.pop(user_uuid, ()):
+            self._discard(user_uuid, target_uuid)
+
+    def _discard(self, user_uuid: str, target_uuid: str):
+        subs = self.targets.get(target_uuid)
+        if subs is None:
+            return
+        subs.discard(user_uuid)
+        if not subs:
+            del self.targets[target_uuid]
+            if self.watcher:
+                self.watcher(target_uuid, False)
+
+    async def load_user(self, user_uuid: str):
+        targets = await run_db(_load_targets, user_uuid)
+        for target_uuid in targets:
+            self.add(user_uuid, target_uuid)
+
+    async def subscribe(self, user_uuid: str, target_uuid: str):
+        if self.add(user_uuid, target_uuid):
+            self._persist(_insert_subscription, user_uuid, target_uuid)
+
+    async def unsubscribe(self, user_uuid: str, target_uuid: str):
+        self.remove(user_uuid, target_uuid)
+        self._persist(_delete_subscription, user_uuid, target_uuid)
+
+    def _persist(self, func, *args):
+        task = asyncio.get_running_loop().run_in_executor(
+            self._writer, partial(with_session, func, *args))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+
+def _load_targets(db, user_uuid: str):
+    rows = db.query(Subscription.target_uuid).filter_by(
+        user_uuid=user_uuid).all()
+    return [row.target_uuid for row in rows]
+
+
+def _insert_subscription(db, user_uuid: str, target_uuid: str):
+    # A single INSERT ... ON CONFLICT DO NOTHING against the unique
+    # (user_uuid, target_uuid) index, so a repeated SUB is a no-op.
+    db.execute(insert(Subscription).values(user_uuid=user_uuid, target_uuid=target_uuid)
+               .on_conflict_do_nothing(index_elements=["user_uuid", "target_uuid"]))
+    db.commit()
+
+
+def _delete_subscription(db, user_uuid: str, target_uuid: str):
+    db.query(Subscription).filter_by(
+        user_uuid=user_uuid, target_uuid=target_uuid).delete()
+    db.commit()
+
+
+subscriptions = SubscriptionIndex()